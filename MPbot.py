@@ -1,491 +1,2537 @@
-import os
-import json
-from datetime import datetime, timedelta
-from flask import Flask, request, Response, redirect, url_for
-import telegram
-import mercadopago
-from dotenv import load_dotenv
-from threading import Thread, Lock
-import time
-
-load_dotenv()
-
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN")
-BOT = telegram.Bot(token=TELEGRAM_TOKEN)
-GROUP_ID = int(os.getenv("TELEGRAM_GROUP_ID"))
-
-
-DB_FILE = "assinantes.json"
-TEMP_PREFS = "pagamentos_temp.json"
-
-app = Flask(__name__)
-sdk = mercadopago.SDK(ACCESS_TOKEN)
-lock = Lock()
-
-PLANOS = {
-    "mensal": {"valor": 19.90, "dias": 30},
-    "trimestral": {"valor": 52.90, "dias": 90}
-}
-
-USUARIO_ADMIN = "greedjr"
-SENHA_ADMIN = "camisa10JR"
-
-# === Utilitários de Banco de Dados ===
-
-def carregar_dados():
-    with lock:
-        if not os.path.exists(DB_FILE):
-            return {}
-        with open(DB_FILE, 'r') as f:
-            return json.load(f)
-
-def salvar_dados(dados):
-    with lock:
-        with open(DB_FILE, 'w') as f:
-            json.dump(dados, f, indent=4)
-
-def salvar_temp_pagamento(preference_id, telegram_id, plano):
-    with lock:
-        if os.path.exists(TEMP_PREFS):
-            with open(TEMP_PREFS, 'r') as f:
-                dados = json.load(f)
-        else:
-            dados = {}
-        dados[preference_id] = {"telegram_id": telegram_id, "plano": plano}
-        with open(TEMP_PREFS, 'w') as f:
-            json.dump(dados, f)
-
-def carregar_temp_pagamento(preference_id):
-    with lock:
-        if not os.path.exists(TEMP_PREFS):
-            return None
-        with open(TEMP_PREFS, 'r') as f:
-            dados = json.load(f)
-        return dados.get(preference_id)
-
-# === Rota para ver e gerenciar assinantes com autenticação ===
-
-import os
-
-USUARIO_ADMIN = os.getenv("USUARIO_ADMIN")
-SENHA_ADMIN = os.getenv("SENHA_ADMIN")
-
-@app.route("/logout")
-def logout():
-    return Response("Logout realizado.", 401, {"WWW-Authenticate": "Basic realm='Login Requerido'"})
-
-@app.route("/painel", methods=["GET", "POST"])
-def painel():
-    auth = request.authorization
-    if not auth or auth.username != USUARIO_ADMIN or auth.password != SENHA_ADMIN:
-        return Response("Acesso negado", 401, {"WWW-Authenticate": "Basic realm='Login Requerido'"})
-
-    dados = carregar_dados()
-
-    # Processar ações do formulário
-    if request.method == "POST":
-        # Remover usuário
-        uid_remover = request.form.get("remover")
-        confirmar = request.form.get("confirmar_remover")
-
-        if uid_remover and confirmar == uid_remover:
-            if uid_remover in dados:
-                try:
-                    BOT.send_message(chat_id=int(uid_remover), text="❌ Sua assinatura foi encerrada manualmente pelo administrador.")
-                    BOT.ban_chat_member(chat_id=GROUP_ID, user_id=int(uid_remover))
-                    BOT.unban_chat_member(chat_id=GROUP_ID, user_id=int(uid_remover))
-                except Exception as e:
-                    print(f"Erro ao remover manualmente {uid_remover}: {e}")
-                del dados[uid_remover]
-                salvar_dados(dados)
-            return redirect(url_for('painel'))
-
-        # Adicionar usuário manualmente
-        novo_id = request.form.get("novo_id")
-        novo_nome = request.form.get("novo_nome")
-        novo_plano = request.form.get("novo_plano")
-        if novo_id and novo_nome and novo_plano:
-            dias = PLANOS.get(novo_plano, {}).get("dias", 30)
-            hoje = datetime.now()
-            vencimento = hoje + timedelta(days=dias)
-            dados[novo_id] = {
-                "nome": novo_nome,
-                "pagamento": hoje.strftime("%Y-%m-%d"),
-                "vencimento": vencimento.strftime("%Y-%m-%d"),
-                "status": "ativo"
-            }
-            salvar_dados(dados)
-            return redirect(url_for('painel'))
-
-        # Gerar link de convite
-        gerar_link_id = request.form.get("gerar_link")
-        if gerar_link_id:
-            try:
-                link_convite = BOT.create_chat_invite_link(
-                    chat_id=GROUP_ID,
-                    expire_date=int((datetime.now() + timedelta(minutes=10)).timestamp()),
-                    member_limit=1
-                ).invite_link
-                BOT.send_message(chat_id=int(gerar_link_id), text=f"🔗 Acesse o grupo com este link (válido por 10 min, 1 uso):\n{link_convite}")
-            except Exception as e:
-                print(f"Erro ao gerar link para {gerar_link_id}: {e}")
-            return redirect(url_for('painel'))
-
-    filtro = request.args.get("filtro", "ativos")
-    html = f"""
-        <html>
-        <head>
-            <title>Painel de Assinantes</title>
-            <style>
-                body {{ font-family: 'Segoe UI', sans-serif; background: #ecf0f1; padding: 30px; }}
-                h2 {{ color: #2c3e50; }}
-                .ativo {{ color: green; }}
-                .inativo {{ color: red; }}
-                select, input[type=text], input[type=submit], button {{ padding: 8px; margin: 5px 0; border-radius: 6px; border: 1px solid #ccc; width: 100%; }}
-                .container {{ background: white; padding: 25px; border-radius: 10px; box-shadow: 0 2px 6px rgba(0,0,0,0.15); max-width: 800px; margin: auto; }}
-                .user-card {{ margin: 15px 0; padding: 15px; border-left: 5px solid #3498db; background: #fdfdfd; border-radius: 6px; }}
-                .btn-remove {{ background: #e74c3c; color: white; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }}
-                .btn-link {{ background: #2ecc71; color: white; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }}
-                .btn-logout {{ background: #95a5a6; color: white; border: none; padding: 6px 12px; border-radius: 4px; margin-top: 15px; cursor: pointer; width: auto; }}
-                .add-form {{ background: #f8f8f8; padding: 20px; border: 1px solid #ddd; border-radius: 10px; margin-top: 20px; }}
-                label {{ display: block; margin-top: 10px; }}
-            </style>
-        </head>
-        <body>
-            <div class='container'>
-            <h2>Painel de Assinantes ({filtro.title()}):</h2>
-            <form method='get'>
-                <select name='filtro' onchange='this.form.submit()'>
-                    <option value='ativos' {'selected' if filtro == 'ativos' else ''}>Ativos</option>
-                    <option value='inativos' {'selected' if filtro == 'inativos' else ''}>Inativos</option>
-                    <option value='todos' {'selected' if filtro == 'todos' else ''}>Todos</option>
-                </select>
-            </form>
-            <form action='/logout' method='get'>
-                <button class='btn-logout'>🔐 Sair</button>
-            </form>
-
-            <div class='add-form'>
-                <h3>Adicionar Usuário Manualmente</h3>
-                <form method='post'>
-                    <label>ID Telegram:</label>
-                    <input type='text' name='novo_id' required>
-                    <label>Nome:</label>
-                    <input type='text' name='novo_nome' required>
-                    <label>Plano:</label>
-                    <select name='novo_plano' required>
-                        <option value='mensal'>Mensal</option>
-                        <option value='trimestral'>Trimestral</option>
-                    </select><br><br>
-                    <input type='submit' value='Adicionar Assinante'>
-                </form>
-            </div>
-
-            <form method='post' onsubmit="return confirm('Tem certeza que deseja remover este usuário?');">
-    """
-
-    for uid, info in dados.items():
-        if filtro == "ativos" and info.get("status") != "ativo":
-            continue
-        if filtro == "inativos" and info.get("status") != "inativo":
-            continue
-
-        nome = info.get("nome", "Desconhecido")
-        pagamento = datetime.strptime(info["pagamento"], "%Y-%m-%d")
-        vencimento = datetime.strptime(info["vencimento"], "%Y-%m-%d")
-        status = info["status"]
-
-        agora = datetime.now()
-        tempo_restante = vencimento - agora
-        dias = tempo_restante.days
-        horas = tempo_restante.seconds // 3600
-        minutos = (tempo_restante.seconds % 3600) // 60
-        tempo_fmt = f"{dias}d {horas}h {minutos}m" if tempo_restante.total_seconds() > 0 else "Expirado"
-
-        html += f"""
-            <div class='user-card'>
-                <b>{nome}</b> (ID: {uid})<br>
-                <b>Pagamento:</b> {pagamento.strftime("%d/%m/%Y")} | 
-                <b>Vencimento:</b> {vencimento.strftime("%d/%m/%Y")}<br>
-                <b>Status:</b> <span class="{status}">{status.title()}</span><br>
-                <b>Tempo restante:</b> {tempo_fmt}<br>
-                <button class='btn-remove' name='remover' value='{uid}'>Remover</button>
-                <input type='hidden' name='confirmar_remover' value='{uid}'>
-                <button class='btn-link' name='gerar_link' value='{uid}'>Gerar Link de Acesso</button>
-            </div>
-        """
-
-    html += """
-            </form>
-            </div>
-        </body>
-        </html>
-    """
-    return html
-
-
-# === Webhook Telegram ===
-
-@app.route("/", methods=["GET", "POST", "HEAD"])
-def webhook():
-    if request.method in ["GET", "HEAD"]:
-        return "Bot de pagamento está ativo."
-
-    update = telegram.Update.de_json(request.get_json(force=True), BOT)
-
-    if update.message and update.message.text:
-        chat_id = update.message.chat.id
-        user_id = update.message.from_user.id
-        texto = update.message.text.lower()
-
-        if texto == "/start":
-            BOT.send_message(
-                chat_id=chat_id,
-                text="Bem-vindo ao Bot de Apostas! Use o menu abaixo para navegar.",
-                reply_markup=telegram.InlineKeyboardMarkup([
-                    [
-                        telegram.InlineKeyboardButton("💰 Pagar (Mensal)", callback_data="pagar_mensal"),
-                        telegram.InlineKeyboardButton("💰 Pagar (Trimestral)", callback_data="pagar_trimestral")
-                    ],
-                    [telegram.InlineKeyboardButton("📄 Ver Planos", callback_data="planos")],
-                    [telegram.InlineKeyboardButton("❓ Ajuda", callback_data="ajuda")]
-                ])
-            )
-
-        elif texto == "/status":
-            dados = carregar_dados()
-            info = dados.get(str(user_id))
-            if info:
-                venc = datetime.strptime(info["vencimento"], "%Y-%m-%d")
-                dias = (venc - datetime.now()).days
-                BOT.send_message(chat_id=chat_id, text=f"✅ Sua assinatura está ativa. Vence em {dias} dia(s), em {info['vencimento']}.")
-            else:
-                BOT.send_message(chat_id=chat_id, text="❌ Você não possui uma assinatura ativa.")
-        else:
-            BOT.send_message(chat_id=chat_id, text="❌ Comando inválido. Por favor, use o menu abaixo:")
-            BOT.send_message(
-                chat_id=chat_id,
-                text="Escolha uma opção:",
-                reply_markup=telegram.InlineKeyboardMarkup([
-                    [
-                        telegram.InlineKeyboardButton("💰 Pagar (Mensal)", callback_data="pagar_mensal"),
-                        telegram.InlineKeyboardButton("💰 Pagar (Trimestral)", callback_data="pagar_trimestral")
-                    ],
-                    [telegram.InlineKeyboardButton("📄 Ver Planos", callback_data="planos")],
-                    [telegram.InlineKeyboardButton("❓ Ajuda", callback_data="ajuda")]
-                ])
-            )
-
-    elif update.callback_query:
-        query = update.callback_query
-        query.answer()
-        user_id = query.from_user.id
-        chat_id = query.message.chat.id
-
-        if query.data.startswith("pagar_"):
-            plano = query.data.replace("pagar_", "")
-            if plano not in PLANOS:
-                BOT.send_message(chat_id=chat_id, text="Plano inválido.")
-                return "ok"
-
-            plano_info = PLANOS[plano]
-            url_base = os.getenv("WEBHOOK_URL")
-            if not url_base.endswith("/notificacao"):
-                url_base += "/notificacao"
-
-            preference_data = {
-                "items": [
-                    {
-                        "title": f"Assinatura {plano} do grupo",
-                        "quantity": 1,
-                        "currency_id": "BRL",
-                        "unit_price": plano_info["valor"]
-                    }
-                ],
-                "back_urls": {
-                    "success": "https://t.me/seu_bot",
-                    "failure": "https://t.me/seu_bot",
-                    "pending": "https://t.me/seu_bot"
-                },
-                "auto_return": "approved",
-                "notification_url": url_base
-            }
-
-            preference = sdk.preference().create(preference_data)
-            checkout_url = preference["response"]["init_point"]
-            preference_id = preference["response"]["id"]
-
-            salvar_temp_pagamento(preference_id, user_id, plano)
-            BOT.send_message(chat_id=chat_id, text="💳 Clique no link abaixo para pagar com Mercado Pago:")
-            BOT.send_message(chat_id=chat_id, text=checkout_url)
-            BOT.send_message(chat_id=chat_id, text="💡 Após o pagamento, aguarde a confirmação automática aqui mesmo.")
-
-        elif query.data == "planos":
-            mensagem = "📋 *Planos disponíveis:*\n\n🔝 Plano Mensal: R$ 19.9 — 30 dias\n🔝 Plano Trimestral: R$ 52.9 — 90 dias"
-            BOT.send_message(
-                chat_id=chat_id,
-                text=mensagem,
-                parse_mode=telegram.ParseMode.MARKDOWN,
-                reply_markup=telegram.InlineKeyboardMarkup([
-                    [telegram.InlineKeyboardButton("🔙 Voltar", callback_data="voltar_menu")]
-                ])
-            )
-
-        elif query.data == "ajuda":
-            ajuda_texto = (
-                "❓ *Ajuda do Bot*\n\n"
-                "🔹 Para *assinar*, escolha uma das opções abaixo:\n"
-                "   - 💰 *Mensal*: R$19,90 por 30 dias\n"
-                "   - 💰 *Trimestral*: R$52,90 por 90 dias\n\n"
-                "🔹 Após o pagamento, o acesso ao grupo VIP será liberado automaticamente.\n"
-                "🔹 Quando sua assinatura estiver prestes a vencer, enviaremos um aviso.\n"
-                "🔹 Você pode renovar a qualquer momento para continuar no grupo.\n\n"
-                "📢 *Dica:* Acompanhe nosso canal gratuito com conteúdos e dicas:\n"
-                "👉 [@overgeared_tips](https://t.me/overgeared_tips)\n\n"
-                "📩 Suporte: overgeared1959@gmail.com"
-            )
-            BOT.send_message(
-                chat_id=chat_id,
-                text=ajuda_texto,
-                parse_mode=telegram.ParseMode.MARKDOWN,
-                reply_markup=telegram.InlineKeyboardMarkup([
-                    [telegram.InlineKeyboardButton("🔙 Voltar", callback_data="voltar_menu")]
-                ])
-            )
-
-        elif query.data == "voltar_menu":
-            BOT.send_message(
-                chat_id=chat_id,
-                text="Escolha uma opção:",
-                reply_markup=telegram.InlineKeyboardMarkup([
-                    [
-                        telegram.InlineKeyboardButton("💰 Pagar (Mensal)", callback_data="pagar_mensal"),
-                        telegram.InlineKeyboardButton("💰 Pagar (Trimestral)", callback_data="pagar_trimestral")
-                    ],
-                    [telegram.InlineKeyboardButton("📄 Ver Planos", callback_data="planos")],
-                    [telegram.InlineKeyboardButton("❓ Ajuda", callback_data="ajuda")]
-                ])
-            )
-
-    return "ok"
-# === Processamento de Pagamento ===
-
-def processar_pagamento(payment_id):
-    payment_info = sdk.payment().get(payment_id)
-    response = payment_info.get("response", {})
-    status = response.get("status")
-    preference_id = response.get("preference_id")
-
-    if not preference_id:
-        order_id = response.get("order", {}).get("id")
-        if order_id:
-            try:
-                order_info = sdk.merchant_order().get(order_id)
-                preference_id = order_info["response"].get("preference_id")
-            except Exception as e:
-                print(f"Erro ao buscar merchant_order: {e}")
-
-    if not preference_id:
-        print("❌ Erro: 'preference_id' não encontrado na resposta do pagamento.")
-        return
-
-    temp = carregar_temp_pagamento(preference_id)
-    if not temp:
-        return
-
-    telegram_id = temp["telegram_id"]
-    plano = temp["plano"]
-    dias = PLANOS.get(plano, {}).get("dias", 30)
-
-    if status == "approved" and telegram_id:
-        try:
-            BOT.get_chat(chat_id=telegram_id)
-        except telegram.error.BadRequest:
-            print(f"❌ Chat {telegram_id} não encontrado. Pagamento aprovado, mas não foi possível enviar a mensagem.")
-            return
-
-        dados = carregar_dados()
-        hoje = datetime.now().strftime("%Y-%m-%d")
-        vencimento = (datetime.now() + timedelta(days=dias)).strftime("%Y-%m-%d")
-
-        dados[str(telegram_id)] = {
-            "pagamento": hoje,
-            "vencimento": vencimento,
-            "status": "ativo"
-        }
-        salvar_dados(dados)
-
-        try:
-            link_convite = BOT.create_chat_invite_link(
-                chat_id=GROUP_ID,
-                expire_date=int((datetime.now() + timedelta(minutes=10)).timestamp()),
-                member_limit=1
-            ).invite_link
-            BOT.send_message(chat_id=telegram_id, text="✅ Pagamento aprovado! Você foi liberado no grupo.")
-            BOT.send_message(
-    chat_id=telegram_id,
-    text=f"☚ Acesse o grupo com este link (válido por 10 minutos e para 1 uso):\n{link_convite}"
-)
-        except Exception as e:
-            print(f"Erro ao criar link de convite: {e}")
-            BOT.send_message(chat_id=telegram_id, text="⚠️ Pagamento aprovado, mas houve erro ao gerar o link de convite. Contate o suporte.")
-
-
-# === Rota de Notificação Mercado Pago ===
-
-@app.route("/notificacao", methods=["POST"])
-def notificacao():
-    data = request.json
-    if not data:
-        return "ignorado"
-
-    if data.get("type") == "payment":
-        payment_id = data.get("data", {}).get("id")
-        processar_pagamento(payment_id)
-
-    elif data.get("type") == "merchant_order":
-        order_id = data.get("data", {}).get("id")
-        order_info = sdk.merchant_order().get(order_id)
-        payments = order_info["response"].get("payments", [])
-
-        for payment in payments:
-            if payment["status"] == "approved":
-                payment_id = payment["id"]
-                processar_pagamento(payment_id)
-
-    return "ok"
-
-# === Verificação Diária de Vencimentos ===
-
-def verificar_vencimentos():
-    while True:
-        time.sleep(30)
-        dados = carregar_dados()
-        hoje = datetime.now().strftime("%Y-%m-%d")
-
-        for uid, info in list(dados.items()):
-            if info["status"] == "ativo":
-                dias_restantes = (datetime.strptime(info["vencimento"], "%Y-%m-%d") - datetime.now()).days
-                if dias_restantes == 1:
-                    try:
-                        BOT.send_message(chat_id=int(uid), text="⏳ Sua assinatura vence amanhã. Renove para continuar no grupo sem interrupções.")
-                    except Exception as e:
-                        print(f"Erro ao avisar {uid}: {e}")
-                if info["vencimento"] < hoje:
-                    try:
-                        BOT.send_message(chat_id=int(uid), text="⚠️ Sua assinatura expirou. Você será removido do grupo.")
-                        BOT.ban_chat_member(chat_id=GROUP_ID, user_id=int(uid))
-                        BOT.unban_chat_member(chat_id=GROUP_ID, user_id=int(uid))
-                    except Exception as e:
-                        print(f"Erro ao remover {uid}: {e}")
-                    dados[uid]["status"] = "inativo"
-
-        salvar_dados(dados)
-
-verificacao_thread = Thread(target=verificar_vencimentos)
-verificacao_thread.daemon = True
-verificacao_thread.start()
-if __name__ == '__main__':
-    print("Rodando localmente. Em produção, use gunicorn.")
-    app.run(host='0.0.0.0', port=5000)
+import os
+import json
+import atexit
+import fcntl
+import socket
+import sqlite3
+from datetime import datetime, timedelta
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from html import escape
+from urllib.parse import urlencode
+from flask import Flask, Blueprint, request, Response, redirect, url_for, stream_with_context, g
+import telegram
+import telegram.utils.request
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock, RLock, Event, local
+import time
+import queue
+
+load_dotenv()
+
+DB_FILE = "assinantes.json"
+DB_GRAVACAO_INTERVALO = float(os.getenv("DB_GRAVACAO_INTERVALO", "2"))
+TEMP_PREFS = "pagamentos_temp.json"
+
+# Configuração da instalação, lida do ambiente por `configurar` ao subir o app
+TELEGRAM_TOKEN = ACCESS_TOKEN = GROUP_ID = None
+DB_SQLITE = DB_BACKEND = FILA_DB = None
+AGENDADOR = AGENDADOR_LOCK = None
+USUARIO_ADMIN = SENHA_ADMIN = None
+_configurado = False
+
+def configurar():
+    """Lê a configuração do ambiente (uma vez por processo)."""
+    global TELEGRAM_TOKEN, ACCESS_TOKEN, GROUP_ID, DB_SQLITE, DB_BACKEND, FILA_DB
+    global AGENDADOR, AGENDADOR_LOCK, USUARIO_ADMIN, SENHA_ADMIN, _configurado
+    if _configurado:
+        return
+    grupo = os.getenv("TELEGRAM_GROUP_ID")
+    if not grupo:
+        raise RuntimeError("TELEGRAM_GROUP_ID não definido.")
+    TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+    ACCESS_TOKEN = os.getenv("MP_ACCESS_TOKEN")
+    GROUP_ID = int(grupo)
+    DB_SQLITE = os.getenv("DB_SQLITE", "assinantes.db")
+    DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+    FILA_DB = os.getenv("FILA_DB", "fila.db")
+    # "thread" roda a verificação de vencimentos numa thread de cada worker (com eleição de
+    # líder); o asgi.py usa "asyncio" e a roda no event loop. Com "nenhum", os workers web não
+    # a rodam e ela precisa subir à parte com `python MPbot.py agendador`.
+    AGENDADOR = os.getenv("AGENDADOR", "thread")
+    AGENDADOR_LOCK = os.getenv("AGENDADOR_LOCK", "agendador.lock")
+    USUARIO_ADMIN = os.getenv("USUARIO_ADMIN")
+    SENHA_ADMIN = os.getenv("SENHA_ADMIN")
+    _configurado = True
+
+# Identifica este processo entre os workers do gunicorn (reservas na fila e nos pagamentos)
+PROCESSO = f"{socket.gethostname()}:{os.getpid()}"
+
+rotas = Blueprint("mpbot", __name__)
+
+def configurar_clientes(bot=None, sdk_mp=None):
+    """Troca os clientes do Telegram e do Mercado Pago (ex.: versões falsas no benchmark.py)."""
+    global BOT, sdk
+    if bot is not None:
+        BOT = bot
+    if sdk_mp is not None:
+        sdk = sdk_mp
+
+PLANOS = {
+    "mensal": {"valor": 19.90, "dias": 30},
+    "trimestral": {"valor": 52.90, "dias": 90}
+}
+
+# === Métricas ===
+
+class Metricas:
+    """Contadores, histogramas e medidores exportados no formato texto do Prometheus."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self._lock = Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.medidores = {}
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def observar(self, nome, valor, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            baldes, soma, contagem = self.histogramas.get(chave) or ([0] * len(self.BUCKETS), 0.0, 0)
+            for i, limite in enumerate(self.BUCKETS):
+                if valor <= limite:
+                    baldes[i] += 1
+            self.histogramas[chave] = (baldes, soma + valor, contagem + 1)
+
+    def medidor(self, nome, funcao, **rotulos):
+        """Registra um valor lido na hora da exportação (ex.: tamanho de fila)."""
+        self.medidores[(nome, tuple(sorted(rotulos.items())))] = funcao
+
+    @contextmanager
+    def medir(self, nome, **rotulos):
+        """Mede a duração do bloco no histograma `nome`; exceções contam em `bot_<x>_erros_total`
+        para `nome` = `bot_<x>_segundos`. Também serve de decorador."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incrementar(nome.removesuffix("_segundos") + "_erros_total", **rotulos)
+            raise
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    @staticmethod
+    def _rotulos(rotulos, extra=()):
+        pares = list(rotulos) + list(extra)
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{chave}="{valor}"' for chave, valor in pares) + "}"
+
+    def exportar(self):
+        with self._lock:
+            contadores = sorted(self.contadores.items())
+            histogramas = sorted(self.histogramas.items())
+        linhas, tipos = [], set()
+        for (nome, rotulos), valor in contadores:
+            if nome not in tipos:
+                tipos.add(nome)
+                linhas.append(f"# TYPE {nome} counter")
+            linhas.append(f"{nome}{self._rotulos(rotulos)} {valor}")
+        for (nome, rotulos), (baldes, soma, contagem) in histogramas:
+            if nome not in tipos:
+                tipos.add(nome)
+                linhas.append(f"# TYPE {nome} histogram")
+            for limite, quantidade in zip(self.BUCKETS, baldes):
+                linhas.append(f"{nome}_bucket{self._rotulos(rotulos, [('le', limite)])} {quantidade}")
+            linhas.append(f"{nome}_bucket{self._rotulos(rotulos, [('le', '+Inf')])} {contagem}")
+            linhas.append(f"{nome}_sum{self._rotulos(rotulos)} {soma}")
+            linhas.append(f"{nome}_count{self._rotulos(rotulos)} {contagem}")
+        for (nome, rotulos), funcao in sorted(self.medidores.items()):
+            if nome not in tipos:
+                tipos.add(nome)
+                linhas.append(f"# TYPE {nome} gauge")
+            linhas.append(f"{nome}{self._rotulos(rotulos)} {funcao()}")
+        return "\n".join(linhas) + "\n"
+
+
+class Medido:
+    """Envolve um objeto e mede a duração de cada método chamado nele."""
+
+    def __init__(self, alvo, metrica):
+        self._alvo = alvo
+        self._metrica = metrica
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._alvo, nome)
+        if not callable(atributo):
+            return atributo
+
+        def chamada_medida(*args, **kwargs):
+            with metricas.medir(self._metrica, operacao=nome):
+                return atributo(*args, **kwargs)
+        return chamada_medida
+
+
+class LockMedido:
+    """Lock reentrante que registra quanto tempo cada thread esperou para adquiri-lo.
+
+    Com `arquivo`, também trava o arquivo (flock), excluindo os outros processos do gunicorn.
+    """
+
+    def __init__(self, nome, arquivo=None):
+        self.nome = nome
+        self.arquivo = arquivo
+        self._lock = RLock()
+        self._fd = None
+        self._profundidade = 0
+
+    def __enter__(self):
+        inicio = time.perf_counter()
+        self._lock.acquire()
+        self._profundidade += 1
+        if self.arquivo and self._profundidade == 1:
+            if self._fd is None:
+                self._fd = open(self.arquivo, "a")
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        metricas.observar("bot_lock_espera_segundos", time.perf_counter() - inicio, lock=self.nome)
+        return self
+
+    def __exit__(self, *exc):
+        self._profundidade -= 1
+        if self._fd is not None and self._profundidade == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+metricas = Metricas()
+lock = LockMedido("global", DB_FILE + ".lock")
+
+# === Clientes HTTP ===
+
+# Um pool por cliente, compartilhado pelas threads: workers de envio, da fila de
+# atualizações e do gunicorn. Conexões além do pool são abertas e descartadas a cada uso.
+HTTP_POOL = int(os.getenv("HTTP_POOL", "16"))
+HTTP_TIMEOUT_CONEXAO = float(os.getenv("HTTP_TIMEOUT_CONEXAO", "5"))
+HTTP_TIMEOUT_LEITURA = float(os.getenv("HTTP_TIMEOUT_LEITURA", "10"))
+# Tempo total das chamadas HTTP feitas ao tratar um update ou uma notificação
+HTTP_PRAZO_WEBHOOK = float(os.getenv("HTTP_PRAZO_WEBHOOK", "20"))
+MP_TENTATIVAS = int(os.getenv("MP_TENTATIVAS", "2"))
+DISJUNTOR_FALHAS = int(os.getenv("DISJUNTOR_FALHAS", "5"))
+DISJUNTOR_ESPERA = float(os.getenv("DISJUNTOR_ESPERA", "30"))
+
+_prazos = local()
+
+
+@contextmanager
+def prazo(segundos):
+    """Limita o tempo somado das chamadas HTTP que a thread fizer dentro do bloco."""
+    anterior = getattr(_prazos, "fim", None)
+    fim = time.monotonic() + segundos
+    _prazos.fim = fim if anterior is None else min(anterior, fim)
+    try:
+        yield
+    finally:
+        _prazos.fim = anterior
+
+
+def _tempo_restante(limite):
+    """`limite` reduzido ao que sobra do prazo da thread; 0 se o prazo já acabou."""
+    fim = getattr(_prazos, "fim", None)
+    if fim is None:
+        return limite
+    return max(0.0, min(limite, fim - time.monotonic()))
+
+
+class CircuitoAberto(Exception):
+    """Chamada recusada pelo disjuntor: falha na hora, sem novas tentativas."""
+
+
+class Disjuntor:
+    """Circuit breaker: depois de `falhas` erros seguidos o serviço é dado como fora do ar e
+    as chamadas falham na hora por `espera` segundos; depois disso uma chamada de teste
+    passa, e o circuito fecha se ela der certo."""
+
+    def __init__(self, nome, falhas=DISJUNTOR_FALHAS, espera=DISJUNTOR_ESPERA):
+        self.nome = nome
+        self.falhas = falhas
+        self.espera = espera
+        self._seguidas = 0
+        self._aberto_ate = 0
+        self._testando = False
+        self._lock = Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self._seguidas < self.falhas:
+                return True
+            if self._testando or time.monotonic() < self._aberto_ate:
+                metricas.incrementar("bot_disjuntor_recusas_total", servico=self.nome)
+                return False
+            self._testando = True
+            return True
+
+    def sucesso(self):
+        with self._lock:
+            self._seguidas = 0
+            self._testando = False
+
+    def falha(self):
+        with self._lock:
+            self._seguidas += 1
+            self._testando = False
+            if self._seguidas >= self.falhas:
+                if self._seguidas == self.falhas:
+                    metricas.incrementar("bot_disjuntor_aberturas_total", servico=self.nome)
+                self._aberto_ate = time.monotonic() + self.espera
+
+    def aberto(self):
+        return self._seguidas >= self.falhas
+
+
+def _estatisticas_pools(gerenciador):
+    """Conexões abertas, requisições feitas e conexões em uso nos pools de um PoolManager do urllib3."""
+    abertas = requisicoes = em_uso = 0
+    for chave in list(gerenciador.pools.keys()):
+        pool = gerenciador.pools.get(chave)
+        if pool is None:
+            continue
+        abertas += pool.num_connections
+        requisicoes += pool.num_requests
+        if pool.pool is not None:
+            em_uso += pool.pool.maxsize - pool.pool.qsize()
+    return {"abertas": abertas, "requisicoes": requisicoes, "em_uso": em_uso}
+
+
+class RequisicaoTelegram(telegram.utils.request.Request):
+    """Request do python-telegram-bot com disjuntor, prazo por thread e estatísticas do pool."""
+
+    __slots__ = ("disjuntor", "timeout_leitura")
+
+    def __init__(self, disjuntor=None, **kwargs):
+        kwargs.setdefault("con_pool_size", HTTP_POOL)
+        kwargs.setdefault("connect_timeout", HTTP_TIMEOUT_CONEXAO)
+        kwargs.setdefault("read_timeout", HTTP_TIMEOUT_LEITURA)
+        super().__init__(**kwargs)
+        self.disjuntor = disjuntor or Disjuntor("telegram")
+        self.timeout_leitura = kwargs["read_timeout"]
+
+    def _request_wrapper(self, *args, **kwargs):
+        if not self.disjuntor.permitir():
+            raise CircuitoAberto("Telegram indisponível (circuito aberto)")
+        timeout = kwargs.get("timeout")
+        leitura = _tempo_restante(timeout.read_timeout if timeout is not None else self.timeout_leitura)
+        if leitura <= 0:
+            raise telegram.error.TimedOut()
+        kwargs["timeout"] = telegram.utils.request.Timeout(
+            connect=min(self._connect_timeout, leitura), read=leitura)
+        try:
+            resposta = super()._request_wrapper(*args, **kwargs)
+        except telegram.error.BadRequest:
+            self.disjuntor.sucesso()
+            raise
+        except telegram.error.NetworkError:
+            self.disjuntor.falha()
+            raise
+        except telegram.error.TelegramError:
+            self.disjuntor.sucesso()
+            raise
+        self.disjuntor.sucesso()
+        return resposta
+
+    def estatisticas(self):
+        return _estatisticas_pools(self._con_pool)
+
+
+class ClienteHTTPMercadoPago:
+    """HttpClient do SDK com uma Session (e um pool de conexões) reaproveitada entre as chamadas.
+
+    O cliente padrão do SDK abre uma Session, e uma conexão TLS, por chamada. O SDK só aceita
+    subclasses do seu HttpClient: a combinação é feita em `classe_http_mercadopago`, para que
+    o SDK (e o requests) só sejam importados no primeiro uso.
+    """
+
+    def __init__(self, pool=HTTP_POOL, disjuntor=None):
+        self.pool = pool
+        self.disjuntor = disjuntor or Disjuntor("mercadopago")
+        self._sessoes = {}
+        self._lock = Lock()
+
+    def _sessao(self, maxretries, retry_on, backoff_factor):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+
+        # Uma Session por política de retry, já que ela fica no adapter
+        chave = (maxretries, tuple(retry_on or ()), backoff_factor)
+        with self._lock:
+            sessao = self._sessoes.get(chave)
+            if sessao is None:
+                tentativas = Retry(
+                    total=maxretries,
+                    status_forcelist=retry_on if retry_on is not None else (429, 500, 502, 503, 504),
+                    backoff_factor=backoff_factor or 0,
+                )
+                sessao = self._sessoes[chave] = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool, max_retries=tentativas)
+                sessao.mount("https://", adaptador)
+                sessao.mount("http://", adaptador)
+            return sessao
+
+    def request(self, method, url, maxretries=None, retry_on=None, backoff_factor=None, **kwargs):
+        import requests
+
+        if not self.disjuntor.permitir():
+            raise CircuitoAberto("Mercado Pago indisponível (circuito aberto)")
+        leitura = _tempo_restante(kwargs.get("timeout") or HTTP_TIMEOUT_LEITURA)
+        if leitura <= 0:
+            raise requests.exceptions.Timeout("Prazo da requisição esgotado")
+        kwargs["timeout"] = (min(HTTP_TIMEOUT_CONEXAO, leitura), leitura)
+        try:
+            resposta = self._sessao(maxretries, retry_on, backoff_factor).request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.disjuntor.falha()
+            raise
+        if resposta.status_code >= 500 or resposta.status_code == 429:
+            self.disjuntor.falha()
+        else:
+            self.disjuntor.sucesso()
+        resultado = {"status": resposta.status_code, "response": None}
+        if resposta.status_code != 204 and resposta.content:
+            try:
+                resultado["response"] = resposta.json()
+            except ValueError:
+                pass
+        return resultado
+
+    def estatisticas(self):
+        total = {"abertas": 0, "requisicoes": 0, "em_uso": 0}
+        for sessao in list(self._sessoes.values()):
+            for chave, valor in _estatisticas_pools(sessao.get_adapter("https://").poolmanager).items():
+                total[chave] += valor
+        return total
+
+
+@lru_cache(maxsize=None)
+def classe_http_mercadopago():
+    import mercadopago.http
+    return type("ClienteHTTPMercadoPago", (ClienteHTTPMercadoPago, mercadopago.http.HttpClient), {})
+
+
+def criar_bot(token=None, **kwargs):
+    configurar()
+    return telegram.Bot(token=token or TELEGRAM_TOKEN, request=RequisicaoTelegram(), **kwargs)
+
+
+def criar_sdk(token=None, http_client=None):
+    import mercadopago
+    import mercadopago.config
+
+    configurar()
+    token = token or ACCESS_TOKEN
+    opcoes = mercadopago.config.RequestOptions(
+        connection_timeout=HTTP_TIMEOUT_LEITURA, max_retries=MP_TENTATIVAS)
+    return mercadopago.SDK(token, http_client=http_client or classe_http_mercadopago()(), request_options=opcoes)
+
+
+class Preguicoso:
+    """Cria o objeto só no primeiro uso, para o boot não montar clientes que a requisição
+    atual nem vai usar."""
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._instancia = None
+        self._lock = Lock()
+
+    def criado(self):
+        return self._instancia
+
+    def __getattr__(self, nome):
+        if self._instancia is None:
+            with self._lock:
+                if self._instancia is None:
+                    self._instancia = self._fabrica()
+        return getattr(self._instancia, nome)
+
+
+BOT = Preguicoso(criar_bot)
+sdk = Preguicoso(criar_sdk)
+
+
+def _cliente_http(servico):
+    cliente = BOT if servico == "telegram" else sdk
+    # /metrics não deve criar o cliente só para dizer que ele não foi usado
+    if isinstance(cliente, Preguicoso):
+        cliente = cliente.criado()
+    if cliente is not None:
+        cliente = cliente.request if servico == "telegram" else getattr(cliente, "http_client", None)
+    return cliente if hasattr(cliente, "estatisticas") else None
+
+
+def _estatistica_http(servico, campo):
+    cliente = _cliente_http(servico)
+    return cliente.estatisticas()[campo] if cliente else 0
+
+
+def _disjuntor_aberto(servico):
+    cliente = _cliente_http(servico)
+    return int(cliente is not None and cliente.disjuntor.aberto())
+
+
+for _servico in ("telegram", "mercadopago"):
+    metricas.medidor("bot_http_conexoes_abertas", partial(_estatistica_http, _servico, "abertas"), servico=_servico)
+    metricas.medidor("bot_http_requisicoes", partial(_estatistica_http, _servico, "requisicoes"), servico=_servico)
+    metricas.medidor("bot_http_conexoes_em_uso", partial(_estatistica_http, _servico, "em_uso"), servico=_servico)
+    metricas.medidor("bot_disjuntor_aberto", partial(_disjuntor_aberto, _servico), servico=_servico)
+
+# === Utilitários de Banco de Dados ===
+
+class ArmazenamentoJSON:
+    """Backend em arquivo JSON, com cache em memória e gravação adiada.
+
+    As leituras saem do cache, que é recarregado quando o mtime do arquivo muda (gravação de
+    outro processo). `salvar` e `remover` marcam o uid como sujo e vão para o disco em lote a
+    cada `intervalo` segundos (ou em `gravar_pendentes`). `atualizar` grava na hora, para
+    continuar atômico entre processos, a não ser dentro de `lote()`, que mantém o lock até
+    o fim do bloco e grava tudo de uma vez. A gravação usa arquivo temporário + rename:
+    uma queda no meio dela deixa o arquivo anterior intacto.
+    """
+
+    def __init__(self, caminho, intervalo=DB_GRAVACAO_INTERVALO):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self._dados = None
+        self._mtime = None
+        self._sujos = set()
+        self._gravador = None
+        self._em_lote = False
+        self._limpar_temporarios()
+
+    def _limpar_temporarios(self):
+        """Apaga os `<caminho>.<pid>.tmp` deixados por processos que caíram no meio de uma gravação.
+
+        Os de processos ainda vivos ficam: podem estar sendo gravados agora.
+        """
+        pasta, nome = os.path.split(os.path.abspath(self.caminho))
+        for arquivo in os.listdir(pasta):
+            pid = arquivo[len(nome) + 1:-len(".tmp")]
+            if not (arquivo.startswith(f"{nome}.") and arquivo.endswith(".tmp") and pid.isdigit()):
+                continue
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue
+            try:
+                os.remove(os.path.join(pasta, arquivo))
+            except FileNotFoundError:
+                pass
+
+    def _mtime_disco(self):
+        try:
+            return os.stat(self.caminho).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _ler(self):
+        if not os.path.exists(self.caminho):
+            return {}
+        with open(self.caminho, 'r') as f:
+            return json.load(f)
+
+    def _mesclar_disco(self):
+        """Relê o arquivo e reaplica por cima as alterações locais ainda não gravadas."""
+        disco = self._ler()
+        for uid in self._sujos:
+            if uid in self._dados:
+                disco[uid] = self._dados[uid]
+            else:
+                disco.pop(uid, None)
+        self._dados = disco
+
+    def _atual(self):
+        # Chamado com o lock adquirido
+        mtime = self._mtime_disco()
+        if self._dados is None:
+            self._dados = self._ler()
+            self._mtime = mtime
+        elif mtime != self._mtime:
+            self._mesclar_disco()
+            self._mtime = mtime
+        return self._dados
+
+    def _gravar_arquivo(self, dados):
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'w') as f:
+            json.dump(dados, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporario, self.caminho)
+        self._mtime = self._mtime_disco()
+
+    def _marcar_sujo(self, uid):
+        self._sujos.add(uid)
+        if self._gravador is None:
+            self._gravador = Thread(target=self._gravar_periodicamente, daemon=True)
+            self._gravador.start()
+            atexit.register(self.gravar_pendentes)
+
+    def _gravar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.gravar_pendentes()
+            except Exception as e:
+                print(f"Erro ao gravar {self.caminho}: {e}")
+
+    def gravar_pendentes(self):
+        with lock:
+            if not self._sujos:
+                return
+            if self._dados is None or self._mtime_disco() != self._mtime:
+                self._mesclar_disco()
+            self._gravar_arquivo(self._dados)
+            self._sujos.clear()
+
+    @contextmanager
+    def lote(self):
+        with lock:
+            self._em_lote = True
+            try:
+                yield
+            finally:
+                self._em_lote = False
+                self.gravar_pendentes()
+
+    def todos(self):
+        with lock:
+            return {uid: dict(info) for uid, info in self._atual().items()}
+
+    def substituir_todos(self, dados):
+        with lock:
+            self._dados = {str(uid): dict(info) for uid, info in dados.items()}
+            self._gravar_arquivo(self._dados)
+            self._sujos.clear()
+
+    def obter(self, uid):
+        with lock:
+            info = self._atual().get(str(uid))
+            return dict(info) if info is not None else None
+
+    def salvar(self, uid, info):
+        with lock:
+            self._atual()[str(uid)] = dict(info)
+            self._marcar_sujo(str(uid))
+
+    def remover(self, uid):
+        with lock:
+            if self._atual().pop(str(uid), None) is not None:
+                self._marcar_sujo(str(uid))
+
+    def atualizar(self, uid, funcao):
+        with lock:
+            dados = self._atual()
+            atual = dados.get(str(uid))
+            info = funcao(dict(atual) if atual is not None else None)
+            if info is not None:
+                dados[str(uid)] = dict(info)
+                self._marcar_sujo(str(uid))
+                if not self._em_lote:
+                    self.gravar_pendentes()
+            return info
+
+    def a_lembrar(self, data):
+        return [
+            (uid, info) for uid, info in self.todos().items()
+            if info.get("status") == "ativo" and info.get("vencimento") == data
+            and info.get("aviso_enviado") != data
+        ]
+
+    def expirados(self, data):
+        return [
+            (uid, info) for uid, info in self.todos().items()
+            if info.get("status") == "ativo" and info.get("vencimento") < data
+        ]
+
+    def _filtrar(self, status, busca):
+        busca = (busca or "").lower()
+        return [
+            (uid, info) for uid, info in self.todos().items()
+            if (status is None or info.get("status") == status)
+            and (not busca or uid == busca or busca in info.get("nome", "").lower())
+        ]
+
+    def listar(self, status=None, busca=None, limite=50, deslocamento=0):
+        encontrados = sorted(self._filtrar(status, busca), key=lambda item: (item[1].get("vencimento", ""), item[0]))
+        return encontrados[deslocamento:deslocamento + limite]
+
+    def contar(self, status=None, busca=None):
+        return len(self._filtrar(status, busca))
+
+    def uids_por_status(self, status, apos="", limite=100):
+        return sorted(uid for uid, info in self.todos().items() if info.get("status") == status and uid > apos)[:limite]
+
+
+class BancoSQLite:
+    """Base dos componentes guardados em SQLite (WAL), com uma conexão por thread."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = local()
+
+    def _conexao(self):
+        # sqlite3 não compartilha conexões entre threads
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.caminho, timeout=30)
+            # Trocar para WAL não espera pelo busy timeout: com vários workers abrindo um banco
+            # novo ao mesmo tempo, a troca pode dar "database is locked" e é repetida
+            for tentativa in range(50):
+                try:
+                    con.execute("PRAGMA journal_mode=WAL")
+                    break
+                except sqlite3.OperationalError:
+                    if tentativa == 49:
+                        raise
+                    time.sleep(0.1)
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+
+class ArmazenamentoSQLite(BancoSQLite):
+    """Backend SQLite: cada assinante é uma linha, lida e gravada individualmente."""
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        with self._conexao() as con:
+            # Só uma tabela recém-criada recebe a importação do JSON antigo
+            self.nova = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'assinantes'"
+            ).fetchone() is None
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS assinantes ("
+                " uid TEXT PRIMARY KEY,"
+                " status TEXT,"
+                " vencimento TEXT,"
+                " aviso TEXT,"
+                " nome TEXT,"
+                " dados TEXT NOT NULL)"
+            )
+            colunas = {linha[1] for linha in con.execute("PRAGMA table_info(assinantes)")}
+            if "aviso" not in colunas:
+                con.execute("ALTER TABLE assinantes ADD COLUMN aviso TEXT")
+            if "nome" not in colunas:
+                con.execute("ALTER TABLE assinantes ADD COLUMN nome TEXT")
+                con.execute("UPDATE assinantes SET nome = json_extract(dados, '$.nome')")
+            # Índices ordenados por vencimento: a verificação periódica só lê quem está vencendo
+            # e o painel pagina por status sem percorrer a tabela inteira
+            con.execute("CREATE INDEX IF NOT EXISTS idx_assinantes_vencimento ON assinantes (status, vencimento)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_assinantes_ordem ON assinantes (vencimento, uid)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_assinantes_status_uid ON assinantes (status, uid)")
+
+    @staticmethod
+    def _linha(uid, info):
+        return (str(uid), info.get("status"), info.get("vencimento"), info.get("aviso_enviado"), info.get("nome"), json.dumps(info))
+
+    def todos(self):
+        linhas = self._conexao().execute("SELECT uid, dados FROM assinantes")
+        return {uid: json.loads(dados) for uid, dados in linhas}
+
+    def substituir_todos(self, dados):
+        with self._conexao() as con:
+            con.execute("DELETE FROM assinantes")
+            con.executemany(
+                "INSERT INTO assinantes (uid, status, vencimento, aviso, nome, dados) VALUES (?, ?, ?, ?, ?, ?)",
+                [self._linha(uid, info) for uid, info in dados.items()]
+            )
+
+    def obter(self, uid):
+        linha = self._conexao().execute(
+            "SELECT dados FROM assinantes WHERE uid = ?", (str(uid),)
+        ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def salvar(self, uid, info):
+        with self._conexao() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO assinantes (uid, status, vencimento, aviso, nome, dados) VALUES (?, ?, ?, ?, ?, ?)",
+                self._linha(uid, info)
+            )
+
+    def remover(self, uid):
+        with self._conexao() as con:
+            con.execute("DELETE FROM assinantes WHERE uid = ?", (str(uid),))
+
+    def atualizar(self, uid, funcao):
+        """Lê o assinante, aplica `funcao(info)` e grava o resultado numa única transação.
+
+        `funcao` recebe None se o assinante não existir e retorna None para não alterar nada.
+        BEGIN IMMEDIATE impede que outro processo grave o mesmo registro no meio do caminho.
+        """
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            linha = con.execute("SELECT dados FROM assinantes WHERE uid = ?", (str(uid),)).fetchone()
+            info = funcao(json.loads(linha[0]) if linha else None)
+            if info is not None:
+                con.execute(
+                    "INSERT OR REPLACE INTO assinantes (uid, status, vencimento, aviso, nome, dados) VALUES (?, ?, ?, ?, ?, ?)",
+                    self._linha(uid, info)
+                )
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        return info
+
+    def a_lembrar(self, data):
+        """Assinantes ativos que vencem em `data` e ainda não receberam o aviso deste ciclo."""
+        linhas = self._conexao().execute(
+            "SELECT uid, dados FROM assinantes"
+            " WHERE status = 'ativo' AND vencimento = ? AND (aviso IS NULL OR aviso <> vencimento)",
+            (data,)
+        )
+        return [(uid, json.loads(dados)) for uid, dados in linhas]
+
+    def expirados(self, data):
+        """Assinantes ativos com vencimento anterior a `data`."""
+        linhas = self._conexao().execute(
+            "SELECT uid, dados FROM assinantes"
+            " WHERE status = 'ativo' AND vencimento < ? ORDER BY vencimento",
+            (data,)
+        )
+        return [(uid, json.loads(dados)) for uid, dados in linhas]
+
+    @staticmethod
+    def _filtro(status, busca):
+        condicoes, parametros = [], []
+        if status is not None:
+            condicoes.append("status = ?")
+            parametros.append(status)
+        if busca:
+            condicoes.append("(uid = ? OR nome LIKE ?)")
+            parametros += [busca, f"%{busca}%"]
+        return (" WHERE " + " AND ".join(condicoes)) if condicoes else "", parametros
+
+    def listar(self, status=None, busca=None, limite=50, deslocamento=0):
+        where, parametros = self._filtro(status, busca)
+        linhas = self._conexao().execute(
+            f"SELECT uid, dados FROM assinantes{where} ORDER BY vencimento, uid LIMIT ? OFFSET ?",
+            parametros + [limite, deslocamento]
+        )
+        return [(uid, json.loads(dados)) for uid, dados in linhas]
+
+    def contar(self, status=None, busca=None):
+        where, parametros = self._filtro(status, busca)
+        return self._conexao().execute(f"SELECT COUNT(*) FROM assinantes{where}", parametros).fetchone()[0]
+
+    def uids_por_status(self, status, apos="", limite=100):
+        """Próximos `limite` uids com o status, em ordem, depois de `apos` (paginação por cursor)."""
+        linhas = self._conexao().execute(
+            "SELECT uid FROM assinantes WHERE status = ? AND uid > ? ORDER BY uid LIMIT ?", (status, apos, limite)
+        )
+        return [uid for (uid,) in linhas]
+
+    def gravar_pendentes(self):
+        # Cada operação já é gravada na sua própria transação
+        pass
+
+    def lote(self):
+        return nullcontext()
+
+    def importar_json(self, caminho):
+        """Importa de uma vez o assinantes.json legado. Retorna quantos registros foram importados."""
+        with open(caminho, 'r') as f:
+            dados = json.load(f)
+        with self._conexao() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO assinantes (uid, status, vencimento, aviso, nome, dados) VALUES (?, ?, ?, ?, ?, ?)",
+                [self._linha(uid, info) for uid, info in dados.items()]
+            )
+        return len(dados)
+
+
+def criar_armazenamento():
+    if DB_BACKEND == "json":
+        return Medido(ArmazenamentoJSON(DB_FILE), "bot_banco_segundos")
+    armazenamento = ArmazenamentoSQLite(DB_SQLITE)
+    if armazenamento.nova and os.path.exists(DB_FILE):
+        total = armazenamento.importar_json(DB_FILE)
+        print(f"📥 {total} assinante(s) importado(s) de {DB_FILE} para {DB_SQLITE}.")
+    return Medido(armazenamento, "bot_banco_segundos")
+
+# Os bancos são abertos em `abrir_bancos`, ao subir o app
+armazenamento = None
+
+def carregar_dados():
+    return armazenamento.todos()
+
+def salvar_dados(dados):
+    armazenamento.substituir_todos(dados)
+
+# === Preferências de Pagamento Pendentes ===
+
+PREFERENCIAS_TTL = int(os.getenv("PREFERENCIAS_TTL_DIAS", "7")) * 86400
+
+
+class PreferenciasPendentes(BancoSQLite):
+    """Checkouts gerados, por preference_id.
+
+    Consultas por chave primária, sempre no banco: outro worker pode ter removido o
+    checkout, e uma cópia em memória o entregaria de novo. Um checkout pago fica marcado
+    em `pago` e continua aqui, porque o mesmo link ainda aceita pagamentos até vencer;
+    todos saem em `expirar` depois de `ttl` segundos, que deve passar da validade do link.
+    """
+
+    def __init__(self, caminho, ttl=PREFERENCIAS_TTL):
+        super().__init__(caminho)
+        self.ttl = ttl
+        self._ultima_limpeza = 0
+        with self._conexao() as con:
+            nova = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'preferencias'"
+            ).fetchone() is None
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS preferencias ("
+                " preference_id TEXT PRIMARY KEY,"
+                " telegram_id INTEGER NOT NULL,"
+                " plano TEXT NOT NULL,"
+                " criado REAL NOT NULL,"
+                " url TEXT,"
+                " pago REAL)"
+            )
+            colunas = {linha[1] for linha in con.execute("PRAGMA table_info(preferencias)")}
+            if "url" not in colunas:
+                con.execute("ALTER TABLE preferencias ADD COLUMN url TEXT")
+            if "pago" not in colunas:
+                con.execute("ALTER TABLE preferencias ADD COLUMN pago REAL")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_preferencias_criado ON preferencias (criado)")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_preferencias_usuario ON preferencias (telegram_id, plano, criado)")
+        if nova and os.path.exists(TEMP_PREFS):
+            self.importar_json(TEMP_PREFS)
+
+    def importar_json(self, caminho):
+        with open(caminho, 'r') as f:
+            dados = json.load(f)
+        agora = time.time()
+        with self._conexao() as con:
+            con.executemany(
+                "INSERT OR IGNORE INTO preferencias (preference_id, telegram_id, plano, criado) VALUES (?, ?, ?, ?)",
+                [(pid, info["telegram_id"], info["plano"], agora) for pid, info in dados.items()]
+            )
+
+    def salvar(self, preference_id, telegram_id, plano, url=None):
+        with self._conexao() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO preferencias (preference_id, telegram_id, plano, criado, url) VALUES (?, ?, ?, ?, ?)",
+                (preference_id, telegram_id, plano, time.time(), url)
+            )
+
+    def pendente(self, telegram_id, plano, validade):
+        """Link de checkout mais recente e ainda não pago do usuário para o plano, se criado há
+        menos de `validade` segundos."""
+        linha = self._conexao().execute(
+            "SELECT url FROM preferencias"
+            " WHERE telegram_id = ? AND plano = ? AND criado > ? AND url IS NOT NULL AND pago IS NULL"
+            " ORDER BY criado DESC LIMIT 1",
+            (telegram_id, plano, time.time() - validade)
+        ).fetchone()
+        return linha[0] if linha else None
+
+    def obter(self, preference_id):
+        linha = self._conexao().execute(
+            "SELECT telegram_id, plano, criado FROM preferencias WHERE preference_id = ?", (preference_id,)
+        ).fetchone()
+        if linha is None:
+            return None
+        return {"telegram_id": linha[0], "plano": linha[1], "criado": linha[2]}
+
+    def quitar(self, preference_id):
+        """Marca o checkout como pago: ele deixa de ser reaproveitado, mas segue reconhecido."""
+        with self._conexao() as con:
+            con.execute(
+                "UPDATE preferencias SET pago = ? WHERE preference_id = ? AND pago IS NULL",
+                (time.time(), preference_id)
+            )
+
+    def expirar(self, intervalo=3600):
+        """Remove os checkouts abandonados; roda no máximo uma vez a cada `intervalo` segundos."""
+        agora = time.time()
+        if agora - self._ultima_limpeza < intervalo:
+            return
+        self._ultima_limpeza = agora
+        limite = agora - self.ttl
+        with self._conexao() as con:
+            removidos = con.execute("DELETE FROM preferencias WHERE criado < ?", (limite,)).rowcount
+        if removidos:
+            print(f"🧹 {removidos} checkout(s) abandonado(s) removido(s).")
+
+
+preferencias = None
+
+def salvar_temp_pagamento(preference_id, telegram_id, plano, url=None):
+    preferencias.salvar(preference_id, telegram_id, plano, url)
+
+def carregar_temp_pagamento(preference_id):
+    return preferencias.obter(preference_id)
+
+def quitar_temp_pagamento(preference_id):
+    preferencias.quitar(preference_id)
+
+# === Fila de Envio para o Telegram ===
+
+ENVIO_WORKERS = int(os.getenv("ENVIO_WORKERS", "4"))
+ENVIO_FILA_MAX = int(os.getenv("ENVIO_FILA_MAX", "10000"))
+ENVIO_LIMITE_GLOBAL = float(os.getenv("ENVIO_LIMITE_GLOBAL", "30"))  # chamadas por segundo
+ENVIO_LIMITE_CHAT = float(os.getenv("ENVIO_LIMITE_CHAT", "1"))  # mensagens por segundo em cada chat
+ENVIO_RAJADA_CHAT = int(os.getenv("ENVIO_RAJADA_CHAT", "3"))  # rajada curta tolerada pelo Telegram
+ENVIO_TENTATIVAS = 5
+
+
+class BaldeTokens:
+    """Token bucket: repõe `taxa` tokens por segundo, acumulando até `capacidade`."""
+
+    def __init__(self, taxa, capacidade=1):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+        self._lock = Lock()
+
+    def reservar(self):
+        """Consome um token e retorna quantos segundos esperar até que ele esteja disponível."""
+        with self._lock:
+            agora = time.monotonic()
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.taxa
+
+    def ocioso(self):
+        with self._lock:
+            return self.tokens + (time.monotonic() - self.atualizado) * self.taxa >= self.capacidade
+
+
+class FilaEnvio:
+    """Despacha as chamadas ao Telegram em segundo plano, respeitando os limites da API.
+
+    As tarefas são funções `tarefa(chamar)`; `chamar(metodo, **kwargs)` executa `bot.metodo`
+    passando pelos limites global e por chat e repete a chamada em caso de RetryAfter ou
+    falha de rede. Com o circuito do Telegram aberto a chamada falha na hora, e um envio de
+    mensagem que estourou o tempo não é repetido: ela pode ter sido entregue. As chamadas de
+    uma mesma tarefa são feitas em ordem.
+    """
+
+    METODOS_POR_CHAT = {"send_message"}
+    METODOS_NAO_IDEMPOTENTES = {"send_message"}
+
+    def __init__(self, bot=None, workers=ENVIO_WORKERS, tamanho=ENVIO_FILA_MAX,
+                 limite_global=ENVIO_LIMITE_GLOBAL, limite_chat=ENVIO_LIMITE_CHAT):
+        self.bot = bot
+        self.workers = workers
+        self.fila = queue.Queue(maxsize=tamanho)
+        self.balde_global = BaldeTokens(limite_global, capacidade=limite_global)
+        self.limite_chat = limite_chat
+        self.baldes_chat = {}
+        self._lock = Lock()
+
+    def iniciar(self):
+        for _ in range(self.workers):
+            Thread(target=self._trabalhar, daemon=True).start()
+
+    def executar(self, tarefa, *args):
+        try:
+            self.fila.put((tarefa, args), timeout=30)
+        except queue.Full:
+            print(f"❌ Fila de envio cheia, tarefa descartada: {getattr(tarefa, '__name__', tarefa)}")
+
+    def enviar(self, metodo, **kwargs):
+        self.executar(lambda chamar: chamar(metodo, **kwargs))
+
+    def _balde_chat(self, chat_id):
+        with self._lock:
+            balde = self.baldes_chat.get(chat_id)
+            if balde is None:
+                if len(self.baldes_chat) >= 10000:
+                    self.baldes_chat = {c: b for c, b in self.baldes_chat.items() if not b.ocioso()}
+                balde = self.baldes_chat[chat_id] = BaldeTokens(self.limite_chat, ENVIO_RAJADA_CHAT)
+            return balde
+
+    def chamar(self, metodo, **kwargs):
+        espera = self.balde_global.reservar()
+        if metodo in self.METODOS_POR_CHAT:
+            espera = max(espera, self._balde_chat(kwargs.get("chat_id")).reservar())
+
+        for tentativa in range(ENVIO_TENTATIVAS):
+            if espera > 0:
+                time.sleep(espera)
+            try:
+                with metricas.medir("bot_telegram_segundos", metodo=metodo):
+                    return getattr(self.bot or BOT, metodo)(**kwargs)
+            except telegram.error.RetryAfter as e:
+                metricas.incrementar("bot_telegram_retry_after_total", metodo=metodo)
+                if tentativa == ENVIO_TENTATIVAS - 1:
+                    raise
+                espera = e.retry_after
+            except telegram.error.BadRequest:
+                raise
+            except telegram.error.TimedOut:
+                if metodo in self.METODOS_NAO_IDEMPOTENTES or tentativa == ENVIO_TENTATIVAS - 1:
+                    raise
+                espera = 2 ** tentativa
+            except telegram.error.NetworkError:
+                if tentativa == ENVIO_TENTATIVAS - 1:
+                    raise
+                espera = 2 ** tentativa
+
+    def _trabalhar(self):
+        while True:
+            tarefa, args = self.fila.get()
+            try:
+                tarefa(self.chamar, *args)
+            except Exception as e:
+                metricas.incrementar("bot_fila_envio_erros_total")
+                print(f"Erro no envio ao Telegram: {e}")
+            finally:
+                self.fila.task_done()
+
+
+fila_envio = FilaEnvio()
+metricas.medidor("bot_fila_envio_tamanho", lambda: fila_envio.fila.qsize())
+
+def _remover_do_grupo(chamar, uid, aviso):
+    try:
+        chamar("send_message", chat_id=int(uid), text=aviso)
+    except Exception as e:
+        print(f"Erro ao avisar {uid}: {e}")
+    try:
+        chamar("ban_chat_member", chat_id=GROUP_ID, user_id=int(uid))
+        chamar("unban_chat_member", chat_id=GROUP_ID, user_id=int(uid))
+        membros.registrar(uid, "left")
+    except Exception as e:
+        print(f"Erro ao remover {uid}: {e}")
+
+def _enviar_convite(chamar, chat_id, texto):
+    link_convite = chamar(
+        "create_chat_invite_link",
+        chat_id=GROUP_ID,
+        expire_date=int((datetime.now() + timedelta(minutes=10)).timestamp()),
+        member_limit=1
+    ).invite_link
+    chamar("send_message", chat_id=chat_id, text=texto.format(link=link_convite))
+
+# === Fila Persistente de Atualizações Recebidas ===
+
+FILA_WORKERS = int(os.getenv("FILA_WORKERS", "4"))
+# Novas tentativas com espera exponencial (30 s, 1 min, 2 min... até 6 h): cobre uma queda
+# longa do Telegram ou do Mercado Pago. Esgotadas, a atualização fica marcada como falha
+# no banco, para `python MPbot.py reprocessar`.
+FILA_TENTATIVAS = int(os.getenv("FILA_TENTATIVAS", "12"))
+FILA_ESPERA = 30
+FILA_ESPERA_MAX = 6 * 3600
+FILA_VARREDURA = 30
+FILA_RESERVA = 300
+PROCESSAMENTO_ASSINCRONO = os.getenv("PROCESSAMENTO_ASSINCRONO", "1") == "1"
+
+
+class FilaAtualizacoes(BancoSQLite):
+    """Guarda em disco as atualizações dos webhooks e as processa em segundo plano.
+
+    O webhook só registra o corpo recebido e responde; os workers chamam o processador
+    da origem ("telegram" ou "mercadopago") e apagam o registro ao terminar. O que ficou
+    pendente quando um processo parou é retomado por `iniciar` ou pela varredura periódica
+    de qualquer worker. Se o processamento falhar, o registro volta para a fila em
+    `proxima` e, esgotadas as tentativas, fica marcado em `falhou` em vez de ser apagado.
+    """
+
+    def __init__(self, caminho, processadores, workers=FILA_WORKERS):
+        super().__init__(caminho)
+        self.processadores = processadores
+        self.workers = workers
+        self.pendentes = queue.Queue()
+        self._na_fila = set()
+        self._lock = Lock()
+        with self._conexao() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS atualizacoes ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " origem TEXT NOT NULL,"
+                " corpo TEXT NOT NULL,"
+                " tentativas INTEGER NOT NULL DEFAULT 0,"
+                " dono TEXT,"
+                " reservado REAL,"
+                " proxima REAL,"
+                " falhou REAL)"
+            )
+            colunas = {linha[1] for linha in con.execute("PRAGMA table_info(atualizacoes)")}
+            if "dono" not in colunas:
+                con.execute("ALTER TABLE atualizacoes ADD COLUMN dono TEXT")
+                con.execute("ALTER TABLE atualizacoes ADD COLUMN reservado REAL")
+            if "proxima" not in colunas:
+                con.execute("ALTER TABLE atualizacoes ADD COLUMN proxima REAL")
+                con.execute("ALTER TABLE atualizacoes ADD COLUMN falhou REAL")
+
+    def registrar(self, origem, corpo):
+        self.registrar_lote([(origem, corpo)])
+
+    def registrar_lote(self, itens):
+        """Grava várias atualizações (origem, corpo) numa única transação."""
+        agora = time.time()
+        with self._conexao() as con:
+            ids = [
+                con.execute(
+                    "INSERT INTO atualizacoes (origem, corpo, proxima) VALUES (?, ?, ?)",
+                    (origem, json.dumps(corpo), agora + FILA_VARREDURA)
+                ).lastrowid
+                for origem, corpo in itens
+            ]
+        for id_atualizacao in ids:
+            self._enfileirar(id_atualizacao)
+
+    def _enfileirar(self, id_atualizacao):
+        # A varredura reencontra o que ainda espera na fila; cada id entra uma vez só
+        with self._lock:
+            if id_atualizacao in self._na_fila:
+                return
+            self._na_fila.add(id_atualizacao)
+        self.pendentes.put(id_atualizacao)
+
+    def _reservar(self, id_atualizacao):
+        """Garante que só um worker trate a atualização; reservas abandonadas vencem após FILA_RESERVA."""
+        agora = time.time()
+        with self._conexao() as con:
+            cursor = con.execute(
+                "UPDATE atualizacoes SET dono = ?, reservado = ?"
+                " WHERE id = ? AND (dono IS NULL OR reservado < ?)",
+                (PROCESSO, agora, id_atualizacao, agora - FILA_RESERVA)
+            )
+        return cursor.rowcount == 1
+
+    def _vencidas(self):
+        """Atualizações que qualquer processo pode pegar: sem dono depois de `proxima` (o processo
+        que as recebeu parou, ou é a vez de uma nova tentativa) ou com a reserva vencida."""
+        agora = time.time()
+        return [id_atualizacao for (id_atualizacao,) in self._conexao().execute(
+            "SELECT id FROM atualizacoes WHERE falhou IS NULL"
+            " AND ((dono IS NULL AND proxima <= ?) OR reservado < ?) ORDER BY id",
+            (agora, agora - FILA_RESERVA)
+        )]
+
+    def iniciar(self):
+        pendentes = self._vencidas()
+        if pendentes:
+            print(f"🔁 Reprocessando {len(pendentes)} atualização(ões) pendente(s).")
+        for id_atualizacao in pendentes:
+            self._enfileirar(id_atualizacao)
+        for _ in range(self.workers):
+            Thread(target=self._trabalhar, daemon=True).start()
+        Thread(target=self._varrer, daemon=True).start()
+
+    def _varrer(self):
+        """Devolve à fila, periodicamente, as atualizações abandonadas e as novas tentativas."""
+        while True:
+            time.sleep(FILA_VARREDURA)
+            try:
+                vencidas = self._vencidas()
+            except sqlite3.Error as e:
+                print(f"Erro ao varrer a fila de atualizações: {e}")
+                continue
+            for id_atualizacao in vencidas:
+                self._enfileirar(id_atualizacao)
+
+    def falhas(self):
+        return self._conexao().execute("SELECT COUNT(*) FROM atualizacoes WHERE falhou IS NOT NULL").fetchone()[0]
+
+    def reprocessar_falhas(self):
+        """Devolve à fila, do zero, as atualizações que esgotaram as tentativas."""
+        with self._conexao() as con:
+            cursor = con.execute(
+                "UPDATE atualizacoes SET falhou = NULL, tentativas = 0, proxima = ?, dono = NULL"
+                " WHERE falhou IS NOT NULL",
+                (time.time(),)
+            )
+        return cursor.rowcount
+
+    def _trabalhar(self):
+        while True:
+            id_atualizacao = self.pendentes.get()
+            with self._lock:
+                self._na_fila.discard(id_atualizacao)
+            if not self._reservar(id_atualizacao):
+                continue
+            linha = self._conexao().execute(
+                "SELECT origem, corpo, tentativas FROM atualizacoes WHERE id = ?", (id_atualizacao,)
+            ).fetchone()
+            if linha is None:
+                continue
+            origem, corpo, tentativas = linha
+            try:
+                with metricas.medir("bot_atualizacao_segundos", origem=origem):
+                    self.processadores[origem](json.loads(corpo))
+            except Exception as e:
+                tentativas += 1
+                metricas.incrementar("bot_fila_atualizacoes_erros_total", origem=origem)
+                print(f"Erro ao processar atualização {id_atualizacao} ({origem}), tentativa {tentativas}: {e}")
+                agora = time.time()
+                if tentativas < FILA_TENTATIVAS:
+                    proxima, falhou = agora + min(FILA_ESPERA * 2 ** (tentativas - 1), FILA_ESPERA_MAX), None
+                else:
+                    proxima, falhou = None, agora
+                    metricas.incrementar("bot_fila_atualizacoes_falhas_total", origem=origem)
+                    print(f"❌ Atualização {id_atualizacao} ({origem}) esgotou as tentativas; mantida como falha.")
+                with self._conexao() as con:
+                    con.execute(
+                        "UPDATE atualizacoes SET tentativas = ?, proxima = ?, falhou = ?, dono = NULL, reservado = NULL"
+                        " WHERE id = ?",
+                        (tentativas, proxima, falhou, id_atualizacao)
+                    )
+                continue
+            with self._conexao() as con:
+                con.execute("DELETE FROM atualizacoes WHERE id = ?", (id_atualizacao,))
+
+# === Histórico de Eventos dos Assinantes ===
+
+# Eventos que deixam o assinante ativo ou inativo; "aviso" não muda a situação
+EVENTOS_ATIVAM = {"importacao", "pagamento", "adicao"}
+EVENTOS_DESATIVAM = {"expiracao", "remocao"}
+ESTATISTICAS_DIAS = 30
+
+
+def _efeitos_evento(tipo, plano, valor, ativo):
+    """O que um evento soma nos totais do dia, dado se o assinante estava ativo antes dele.
+
+    Retorna (ativo depois, [(chave, valor)], variação de ativos). Usado tanto na gravação
+    de cada evento quanto na reconstrução a partir do histórico.
+    """
+    somas = [(tipo, 1)]
+    if tipo == "pagamento":
+        somas += [(f"receita:{plano}", valor or 0), (f"pagamentos:{plano}", 1)]
+        if ativo:
+            somas.append(("renovacoes", 1))
+    if tipo in EVENTOS_ATIVAM and not ativo:
+        if tipo != "importacao":
+            somas.append(("novos", 1))
+        return True, somas, 1
+    if tipo in EVENTOS_DESATIVAM and ativo:
+        somas.append(("saidas", 1))
+        return False, somas, -1
+    return ativo, somas, 0
+
+
+class RegistroEventos(BancoSQLite):
+    """Histórico só de inclusão (pagamento, adição e remoção manual, expiração, aviso), com
+    os totais por dia mantidos a cada evento, na mesma transação.
+
+    Os registros de assinantes são sobrescritos a cada renovação; é daqui que saem receita,
+    renovações e churn. `reconstruir` recalcula os totais relendo o histórico uma vez.
+    """
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        with self._conexao() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS eventos ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " momento REAL NOT NULL,"
+                " tipo TEXT NOT NULL,"
+                " uid TEXT NOT NULL,"
+                " plano TEXT,"
+                " valor REAL)"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS eventos_situacao (uid TEXT PRIMARY KEY, ativo INTEGER NOT NULL)")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS eventos_diario ("
+                " dia TEXT NOT NULL, chave TEXT NOT NULL, valor REAL NOT NULL,"
+                " PRIMARY KEY (dia, chave)) WITHOUT ROWID"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS eventos_totais (chave TEXT PRIMARY KEY, valor REAL NOT NULL)")
+
+    def registrar(self, tipo, uid, plano=None, valor=None):
+        self.registrar_varios([(tipo, uid, plano, valor)])
+
+    def registrar_varios(self, itens):
+        """Grava os eventos (tipo, uid, plano, valor) e atualiza os totais numa transação.
+
+        Uma falha aqui é só registrada: o histórico não derruba a operação que ele descreve.
+        """
+        if not itens:
+            return
+        momento = time.time()
+        dia = datetime.fromtimestamp(momento).date().isoformat()
+        con = self._conexao()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                for tipo, uid, plano, valor in itens:
+                    con.execute(
+                        "INSERT INTO eventos (momento, tipo, uid, plano, valor) VALUES (?, ?, ?, ?, ?)",
+                        (momento, tipo, str(uid), plano, valor)
+                    )
+                    self._aplicar(con, dia, tipo, str(uid), plano, valor)
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+        except Exception as e:
+            metricas.incrementar("bot_eventos_erros_total")
+            print(f"Erro ao registrar eventos: {e}")
+
+    def _aplicar(self, con, dia, tipo, uid, plano, valor):
+        linha = con.execute("SELECT ativo FROM eventos_situacao WHERE uid = ?", (uid,)).fetchone()
+        ativo, somas, variacao = _efeitos_evento(tipo, plano, valor, bool(linha and linha[0]))
+        con.execute("INSERT OR REPLACE INTO eventos_situacao (uid, ativo) VALUES (?, ?)", (uid, int(ativo)))
+        con.executemany(
+            "INSERT INTO eventos_diario (dia, chave, valor) VALUES (?, ?, ?)"
+            " ON CONFLICT (dia, chave) DO UPDATE SET valor = valor + excluded.valor",
+            [(dia, chave, soma) for chave, soma in somas]
+        )
+        if variacao:
+            con.execute(
+                "INSERT INTO eventos_totais (chave, valor) VALUES ('ativos', ?)"
+                " ON CONFLICT (chave) DO UPDATE SET valor = valor + excluded.valor",
+                (variacao,)
+            )
+
+    def importar(self, uids):
+        """Abre o histórico com um evento "importacao" por assinante já ativo; não faz nada se
+        já houver eventos (outro worker pode ter importado primeiro)."""
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if con.execute("SELECT 1 FROM eventos LIMIT 1").fetchone() is None:
+                momento = time.time()
+                dia = datetime.fromtimestamp(momento).date().isoformat()
+                for uid in uids:
+                    con.execute(
+                        "INSERT INTO eventos (momento, tipo, uid) VALUES (?, 'importacao', ?)", (momento, str(uid))
+                    )
+                    self._aplicar(con, dia, "importacao", str(uid), None, None)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+    def vazio(self):
+        return self._conexao().execute("SELECT 1 FROM eventos LIMIT 1").fetchone() is None
+
+    def reconstruir(self):
+        """Recalcula situação e totais numa única passada pelo histórico, em ordem."""
+        situacao, diario, ativos = {}, {}, 0
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for momento, tipo, uid, plano, valor in con.execute(
+                "SELECT momento, tipo, uid, plano, valor FROM eventos ORDER BY id"
+            ):
+                dia = datetime.fromtimestamp(momento).date().isoformat()
+                situacao[uid], somas, variacao = _efeitos_evento(tipo, plano, valor, situacao.get(uid, False))
+                ativos += variacao
+                for chave, soma in somas:
+                    diario[(dia, chave)] = diario.get((dia, chave), 0) + soma
+            con.execute("DELETE FROM eventos_situacao")
+            con.execute("DELETE FROM eventos_diario")
+            con.execute("DELETE FROM eventos_totais")
+            con.executemany("INSERT INTO eventos_situacao (uid, ativo) VALUES (?, ?)",
+                            ((uid, int(ativo)) for uid, ativo in situacao.items()))
+            con.executemany("INSERT INTO eventos_diario (dia, chave, valor) VALUES (?, ?, ?)",
+                            ((dia, chave, valor) for (dia, chave), valor in diario.items()))
+            con.execute("INSERT INTO eventos_totais (chave, valor) VALUES ('ativos', ?)", (ativos,))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+    def resumo(self, dias=ESTATISTICAS_DIAS):
+        """Totais dos últimos `dias` dias; lê só as linhas diárias da janela, não o histórico."""
+        inicio = (datetime.now().date() - timedelta(days=dias - 1)).isoformat()
+        con = self._conexao()
+        linha = con.execute("SELECT valor FROM eventos_totais WHERE chave = 'ativos'").fetchone()
+        ativos = int(linha[0]) if linha else 0
+        janela, receita_diaria = {}, {}
+        for dia, chave, valor in con.execute(
+            "SELECT dia, chave, valor FROM eventos_diario WHERE dia >= ? ORDER BY dia", (inicio,)
+        ):
+            janela[chave] = janela.get(chave, 0) + valor
+            if chave.startswith("receita:"):
+                receita_diaria.setdefault(dia, {})[chave.removeprefix("receita:")] = valor
+        # Ativos no início da janela: os de agora, sem os que entraram e com os que saíram nela
+        ativos_inicio = ativos - janela.get("novos", 0) + janela.get("saidas", 0)
+        return {
+            "dias": dias,
+            "ativos": ativos,
+            "janela": janela,
+            "receita_diaria": receita_diaria,
+            "churn": janela.get("saidas", 0) / ativos_inicio if ativos_inicio > 0 else 0.0,
+        }
+
+
+def _uids_ativos():
+    apos = ""
+    while True:
+        uids = armazenamento.uids_por_status("ativo", apos, 1000)
+        if not uids:
+            return
+        yield from uids
+        apos = uids[-1]
+
+
+eventos = None
+
+# === Rota para ver e gerenciar assinantes com autenticação ===
+
+def admin_autenticado():
+    auth = request.authorization
+    return bool(auth) and auth.username == USUARIO_ADMIN and auth.password == SENHA_ADMIN
+
+def acesso_negado():
+    return Response("Acesso negado", 401, {"WWW-Authenticate": "Basic realm='Login Requerido'"})
+
+@rotas.before_app_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+
+@rotas.after_app_request
+def registrar_medicao(response):
+    rota = request.url_rule.rule if request.url_rule else "desconhecida"
+    metricas.observar("bot_http_segundos", time.perf_counter() - g.inicio_requisicao, rota=rota)
+    metricas.incrementar("bot_http_respostas_total", rota=rota, status=response.status_code)
+    return response
+
+@rotas.route("/metrics")
+def exportar_metricas():
+    if not admin_autenticado():
+        return acesso_negado()
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+@rotas.route("/logout")
+def logout():
+    return Response("Logout realizado.", 401, {"WWW-Authenticate": "Basic realm='Login Requerido'"})
+
+@rotas.route("/painel", methods=["GET", "POST"])
+def painel():
+    if not admin_autenticado():
+        return acesso_negado()
+
+    # Processar ações do formulário
+    if request.method == "POST":
+        # Remover usuário
+        uid_remover = request.form.get("remover")
+        confirmar = request.form.get("confirmar_remover")
+
+        if uid_remover and confirmar == uid_remover:
+            if armazenamento.obter(uid_remover) is not None:
+                fila_envio.executar(_remover_do_grupo, uid_remover, "❌ Sua assinatura foi encerrada manualmente pelo administrador.")
+                armazenamento.remover(uid_remover)
+                eventos.registrar("remocao", uid_remover)
+            return redirect(url_for('.painel'))
+
+        # Adicionar usuário manualmente
+        novo_id = request.form.get("novo_id")
+        novo_nome = request.form.get("novo_nome")
+        novo_plano = request.form.get("novo_plano")
+        if novo_id and novo_nome and novo_plano:
+            dias = PLANOS.get(novo_plano, {}).get("dias", 30)
+            armazenamento.atualizar(novo_id, partial(_renovar, dias, nome=novo_nome))
+            eventos.registrar("adicao", novo_id, novo_plano)
+            return redirect(url_for('.painel'))
+
+        # Gerar link de convite
+        gerar_link_id = request.form.get("gerar_link")
+        if gerar_link_id:
+            fila_envio.executar(_enviar_convite, int(gerar_link_id), "🔗 Acesse o grupo com este link (válido por 10 min, 1 uso):\n{link}")
+            return redirect(url_for('.painel'))
+
+    filtro = request.args.get("filtro", "ativos")
+    busca = request.args.get("busca", "").strip()
+    pagina = max(request.args.get("pagina", 1, type=int), 1)
+    return Response(stream_with_context(_gerar_painel(filtro, busca, pagina)), mimetype="text/html")
+
+
+@rotas.route("/painel/estatisticas", methods=["GET", "POST"])
+def estatisticas():
+    if not admin_autenticado():
+        return acesso_negado()
+
+    if request.method == "POST" and request.form.get("reconstruir"):
+        eventos.reconstruir()
+        return redirect(url_for('.estatisticas'))
+
+    resumo = eventos.resumo()
+    janela = resumo["janela"]
+    linhas_planos = "".join(
+        f"<tr><td>{escape(plano.title())}</td><td>{int(janela.get(f'pagamentos:{plano}', 0))}</td>"
+        f"<td>{_preco(janela.get(f'receita:{plano}', 0))}</td></tr>"
+        for plano in PLANOS
+    )
+    linhas_dias = "".join(
+        f"<tr><td>{_data_br(dia)}</td>"
+        + "".join(f"<td>{_preco(receitas.get(plano, 0))}</td>" for plano in PLANOS)
+        + "</tr>"
+        for dia, receitas in sorted(resumo["receita_diaria"].items(), reverse=True)
+    )
+
+    return f"""
+        <html>
+        <head>
+            <title>Estatísticas</title>
+            <style>
+                body {{ font-family: 'Segoe UI', sans-serif; background: #ecf0f1; padding: 30px; }}
+                h2, h3 {{ color: #2c3e50; }}
+                .container {{ background: white; padding: 25px; border-radius: 10px; box-shadow: 0 2px 6px rgba(0,0,0,0.15); max-width: 800px; margin: auto; }}
+                table {{ width: 100%; border-collapse: collapse; margin: 10px 0; }}
+                td, th {{ padding: 6px; border-bottom: 1px solid #ddd; text-align: left; }}
+                .btn-logout {{ background: #95a5a6; color: white; border: none; padding: 6px 12px; border-radius: 4px; margin-top: 15px; cursor: pointer; width: auto; }}
+            </style>
+        </head>
+        <body>
+            <div class='container'>
+            <h2>Estatísticas (últimos {resumo["dias"]} dias)</h2>
+            <p><b>Ativos:</b> {resumo["ativos"]} |
+               <b>Novos:</b> {int(janela.get("novos", 0))} |
+               <b>Renovações:</b> {int(janela.get("renovacoes", 0))} |
+               <b>Saídas:</b> {int(janela.get("saidas", 0))} |
+               <b>Churn:</b> {resumo["churn"] * 100:.1f}%</p>
+            <p><b>Expirações:</b> {int(janela.get("expiracao", 0))} |
+               <b>Remoções manuais:</b> {int(janela.get("remocao", 0))} |
+               <b>Adições manuais:</b> {int(janela.get("adicao", 0))} |
+               <b>Avisos enviados:</b> {int(janela.get("aviso", 0))}</p>
+
+            <h3>Receita por plano</h3>
+            <table><tr><th>Plano</th><th>Pagamentos</th><th>Receita</th></tr>{linhas_planos}</table>
+
+            <h3>Receita por dia</h3>
+            <table><tr><th>Dia</th>{"".join(f"<th>{escape(plano.title())}</th>" for plano in PLANOS)}</tr>{linhas_dias}</table>
+
+            <form method='post'>
+                <a href='{url_for('.painel')}'>« Voltar ao painel</a>
+                <button class='btn-logout' name='reconstruir' value='1'
+                        onclick="return confirm('Recalcular as estatísticas a partir do histórico?');">Recalcular do histórico</button>
+            </form>
+            </div>
+        </body>
+        </html>
+    """
+
+
+PAINEL_POR_PAGINA = 50
+FILTROS_PAINEL = {"ativos": "ativo", "inativos": "inativo", "todos": None}
+
+@lru_cache(maxsize=4096)
+def _data_iso(texto):
+    return datetime.fromisoformat(texto)
+
+def _data_br(texto):
+    return f"{texto[8:10]}/{texto[5:7]}/{texto[:4]}"
+
+def _gerar_painel(filtro, busca, pagina):
+    """Gera o HTML do painel em partes, uma página de assinantes por vez."""
+    status_filtro = FILTROS_PAINEL.get(filtro)
+    total = armazenamento.contar(status_filtro, busca)
+    paginas = max((total + PAINEL_POR_PAGINA - 1) // PAINEL_POR_PAGINA, 1)
+    pagina = min(pagina, paginas)
+
+    yield f"""
+        <html>
+        <head>
+            <title>Painel de Assinantes</title>
+            <style>
+                body {{ font-family: 'Segoe UI', sans-serif; background: #ecf0f1; padding: 30px; }}
+                h2 {{ color: #2c3e50; }}
+                .ativo {{ color: green; }}
+                .inativo {{ color: red; }}
+                select, input[type=text], input[type=submit], button {{ padding: 8px; margin: 5px 0; border-radius: 6px; border: 1px solid #ccc; width: 100%; }}
+                .container {{ background: white; padding: 25px; border-radius: 10px; box-shadow: 0 2px 6px rgba(0,0,0,0.15); max-width: 800px; margin: auto; }}
+                .user-card {{ margin: 15px 0; padding: 15px; border-left: 5px solid #3498db; background: #fdfdfd; border-radius: 6px; }}
+                .btn-remove {{ background: #e74c3c; color: white; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }}
+                .btn-link {{ background: #2ecc71; color: white; border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; }}
+                .btn-logout {{ background: #95a5a6; color: white; border: none; padding: 6px 12px; border-radius: 4px; margin-top: 15px; cursor: pointer; width: auto; }}
+                .add-form {{ background: #f8f8f8; padding: 20px; border: 1px solid #ddd; border-radius: 10px; margin-top: 20px; }}
+                .paginacao {{ text-align: center; margin-top: 20px; }}
+                label {{ display: block; margin-top: 10px; }}
+            </style>
+        </head>
+        <body>
+            <div class='container'>
+            <h2>Painel de Assinantes ({escape(filtro.title())}): {total}</h2>
+            <form method='get'>
+                <select name='filtro' onchange='this.form.submit()'>
+                    <option value='ativos' {'selected' if filtro == 'ativos' else ''}>Ativos</option>
+                    <option value='inativos' {'selected' if filtro == 'inativos' else ''}>Inativos</option>
+                    <option value='todos' {'selected' if filtro == 'todos' else ''}>Todos</option>
+                </select>
+                <input type='text' name='busca' value='{escape(busca)}' placeholder='Buscar por ID ou nome'>
+            </form>
+            <form action='/logout' method='get'>
+                <button class='btn-logout'>🔐 Sair</button>
+                <button class='btn-logout' formaction='/painel/estatisticas'>📊 Estatísticas</button>
+            </form>
+
+            <div class='add-form'>
+                <h3>Adicionar Usuário Manualmente</h3>
+                <form method='post'>
+                    <label>ID Telegram:</label>
+                    <input type='text' name='novo_id' required>
+                    <label>Nome:</label>
+                    <input type='text' name='novo_nome' required>
+                    <label>Plano:</label>
+                    <select name='novo_plano' required>
+                        <option value='mensal'>Mensal</option>
+                        <option value='trimestral'>Trimestral</option>
+                    </select><br><br>
+                    <input type='submit' value='Adicionar Assinante'>
+                </form>
+            </div>
+    """
+
+    agora = datetime.now()
+    assinantes = armazenamento.listar(status_filtro, busca, PAINEL_POR_PAGINA, (pagina - 1) * PAINEL_POR_PAGINA)
+    for uid, info in assinantes:
+        nome = escape(info.get("nome", "Desconhecido"))
+        uid = escape(uid)
+        status = info["status"]
+
+        tempo_restante = _data_iso(info["vencimento"]) - agora
+        dias = tempo_restante.days
+        horas = tempo_restante.seconds // 3600
+        minutos = (tempo_restante.seconds % 3600) // 60
+        tempo_fmt = f"{dias}d {horas}h {minutos}m" if tempo_restante.total_seconds() > 0 else "Expirado"
+
+        yield f"""
+            <form method='post' class='user-card'>
+                <b>{nome}</b> (ID: {uid})<br>
+                <b>Pagamento:</b> {_data_br(info["pagamento"])} | 
+                <b>Vencimento:</b> {_data_br(info["vencimento"])}<br>
+                <b>Status:</b> <span class="{status}">{status.title()}</span><br>
+                <b>Tempo restante:</b> {tempo_fmt}<br>
+                <input type='hidden' name='confirmar_remover' value='{uid}'>
+                <button class='btn-remove' name='remover' value='{uid}' onclick="return confirm('Tem certeza que deseja remover este usuário?');">Remover</button>
+                <button class='btn-link' name='gerar_link' value='{uid}'>Gerar Link de Acesso</button>
+            </form>
+        """
+
+    navegacao = []
+    if pagina > 1:
+        navegacao.append(f"<a href='?{urlencode({'filtro': filtro, 'busca': busca, 'pagina': pagina - 1})}'>« Anterior</a>")
+    navegacao.append(f"Página {pagina} de {paginas}")
+    if pagina < paginas:
+        navegacao.append(f"<a href='?{urlencode({'filtro': filtro, 'busca': busca, 'pagina': pagina + 1})}'>Próxima »</a>")
+
+    yield f"""
+            <div class='paginacao'>{' | '.join(navegacao)}</div>
+            </div>
+        </body>
+        </html>
+    """
+
+
+# === Checkout Mercado Pago ===
+
+CHECKOUT_VALIDADE = int(os.getenv("CHECKOUT_VALIDADE_HORAS", "24")) * 3600
+# Um link só é reaproveitado se ainda tiver esse tempo de validade para o usuário pagar
+CHECKOUT_MARGEM = int(os.getenv("CHECKOUT_MARGEM_MINUTOS", "60")) * 60
+
+
+def gerar_checkout(telegram_id, plano):
+    """Retorna o link de pagamento do plano, reaproveitando o checkout ainda válido do usuário."""
+    inicio = time.perf_counter()
+    checkout_url = preferencias.pendente(telegram_id, plano, max(0, CHECKOUT_VALIDADE - CHECKOUT_MARGEM))
+    if checkout_url:
+        metricas.observar("bot_checkout_segundos", time.perf_counter() - inicio, resultado="reaproveitado")
+        return checkout_url
+
+    url_base = os.getenv("WEBHOOK_URL")
+    if not url_base.endswith("/notificacao"):
+        url_base += "/notificacao"
+
+    preference_data = {
+        "items": [
+            {
+                "title": f"Assinatura {plano} do grupo",
+                "quantity": 1,
+                "currency_id": "BRL",
+                "unit_price": PLANOS[plano]["valor"]
+            }
+        ],
+        "back_urls": {
+            "success": "https://t.me/seu_bot",
+            "failure": "https://t.me/seu_bot",
+            "pending": "https://t.me/seu_bot"
+        },
+        "auto_return": "approved",
+        "notification_url": url_base,
+        # O link expira CHECKOUT_MARGEM depois do fim do reaproveitamento, para nunca
+        # entregarmos um checkout vencido ou prestes a vencer
+        "expires": True,
+        "expiration_date_to": (datetime.now().astimezone() + timedelta(seconds=CHECKOUT_VALIDADE)).isoformat(timespec="milliseconds")
+    }
+
+    with metricas.medir("bot_mercadopago_segundos", chamada="preference.create"):
+        preference = sdk.preference().create(preference_data)
+    checkout_url = preference["response"]["init_point"]
+    preference_id = preference["response"]["id"]
+
+    salvar_temp_pagamento(preference_id, telegram_id, plano, checkout_url)
+    metricas.observar("bot_checkout_segundos", time.perf_counter() - inicio, resultado="criado")
+    return checkout_url
+
+
+# === Webhook Telegram ===
+
+def _preco(valor):
+    return f"R$ {valor:.2f}".replace(".", ",")
+
+# Teclados e textos montados uma única vez, a partir de PLANOS
+TECLADO_MENU = telegram.InlineKeyboardMarkup([
+    [
+        telegram.InlineKeyboardButton(f"💰 Pagar ({plano.title()})", callback_data=f"pagar_{plano}")
+        for plano in PLANOS
+    ],
+    [telegram.InlineKeyboardButton("📄 Ver Planos", callback_data="planos")],
+    [telegram.InlineKeyboardButton("❓ Ajuda", callback_data="ajuda")]
+])
+
+TECLADO_VOLTAR = telegram.InlineKeyboardMarkup([
+    [telegram.InlineKeyboardButton("🔙 Voltar", callback_data="voltar_menu")]
+])
+
+TEXTO_PLANOS = "📋 *Planos disponíveis:*\n\n" + "\n".join(
+    f"🔝 Plano {plano.title()}: {_preco(info['valor'])} — {info['dias']} dias"
+    for plano, info in PLANOS.items()
+)
+
+TEXTO_AJUDA = (
+    "❓ *Ajuda do Bot*\n\n"
+    "🔹 Para *assinar*, escolha uma das opções abaixo:\n"
+    + "".join(
+        f"   - 💰 *{plano.title()}*: {_preco(info['valor'])} por {info['dias']} dias\n"
+        for plano, info in PLANOS.items()
+    )
+    + "\n"
+    "🔹 Após o pagamento, o acesso ao grupo VIP será liberado automaticamente.\n"
+    "🔹 Quando sua assinatura estiver prestes a vencer, enviaremos um aviso.\n"
+    "🔹 Você pode renovar a qualquer momento para continuar no grupo.\n\n"
+    "📢 *Dica:* Acompanhe nosso canal gratuito com conteúdos e dicas:\n"
+    "👉 [@overgeared_tips](https://t.me/overgeared_tips)\n\n"
+    "📩 Suporte: overgeared1959@gmail.com"
+)
+
+# Rotas do bot: comandos de texto e callback_data dos botões, cada um com seu handler(chat_id, user_id)
+COMANDOS = {}
+CALLBACKS = {}
+
+def comando(*nomes):
+    def registrar(funcao):
+        for nome in nomes:
+            COMANDOS[nome] = funcao
+        return funcao
+    return registrar
+
+def botao(*dados):
+    def registrar(funcao):
+        for dado in dados:
+            CALLBACKS[dado] = funcao
+        return funcao
+    return registrar
+
+
+@rotas.route("/", methods=["GET", "POST", "HEAD"])
+def webhook():
+    if request.method in ["GET", "HEAD"]:
+        return "Bot de pagamento está ativo."
+
+    dados = request.get_json(force=True, silent=True)
+    if not isinstance(dados, dict) or "update_id" not in dados or not update_relevante(dados):
+        return "ignorado"
+
+    if PROCESSAMENTO_ASSINCRONO:
+        fila_atualizacoes.registrar("telegram", dados)
+    else:
+        processar_update(dados)
+    return "ok"
+
+
+def update_relevante(dados):
+    """Filtro barato sobre o JSON cru: só mensagens de texto, cliques em botões e entradas e
+    saídas do grupo interessam."""
+    if "chat_member" in dados:
+        return dados["chat_member"].get("chat", {}).get("id") == GROUP_ID
+    mensagem = dados.get("message")
+    if mensagem is not None:
+        return "text" in mensagem
+    callback = dados.get("callback_query")
+    return callback is not None and "data" in callback and "message" in callback
+
+
+@prazo(HTTP_PRAZO_WEBHOOK)
+def processar_update(dados):
+    # Lê só os campos usados direto do JSON, sem montar o telegram.Update inteiro
+    membro = dados.get("chat_member")
+    if membro and membro.get("chat", {}).get("id") == GROUP_ID:
+        novo = membro["new_chat_member"]
+        membros.registrar(novo["user"]["id"], novo["status"])
+        return
+
+    mensagem = dados.get("message")
+    if mensagem and mensagem.get("text"):
+        chat_id = mensagem["chat"]["id"]
+        user_id = mensagem["from"]["id"]
+        handler = COMANDOS.get(mensagem["text"].lower(), _comando_invalido)
+        handler(chat_id, user_id)
+        return
+
+    query = dados.get("callback_query")
+    if query and query.get("data") and query.get("message"):
+        fila_envio.enviar("answer_callback_query", callback_query_id=query["id"])
+        handler = CALLBACKS.get(query["data"])
+        if handler is None and query["data"].startswith("pagar_"):
+            handler = _plano_invalido
+        if handler:
+            handler(query["message"]["chat"]["id"], query["from"]["id"])
+
+
+@comando("/start")
+def _start(chat_id, user_id):
+    fila_envio.enviar(
+        "send_message",
+        chat_id=chat_id,
+        text="Bem-vindo ao Bot de Apostas! Use o menu abaixo para navegar.",
+        reply_markup=TECLADO_MENU
+    )
+
+@comando("/status")
+def _status(chat_id, user_id):
+    info = armazenamento.obter(user_id)
+    if info:
+        venc = datetime.strptime(info["vencimento"], "%Y-%m-%d")
+        dias = (venc - datetime.now()).days
+        fila_envio.enviar("send_message", chat_id=chat_id, text=f"✅ Sua assinatura está ativa. Vence em {dias} dia(s), em {info['vencimento']}.")
+    else:
+        fila_envio.enviar("send_message", chat_id=chat_id, text="❌ Você não possui uma assinatura ativa.")
+
+def _comando_invalido(chat_id, user_id):
+    def enviar(chamar):
+        chamar("send_message", chat_id=chat_id, text="❌ Comando inválido. Por favor, use o menu abaixo:")
+        chamar("send_message", chat_id=chat_id, text="Escolha uma opção:", reply_markup=TECLADO_MENU)
+    fila_envio.executar(enviar)
+
+def _pagar(plano):
+    def handler(chat_id, user_id):
+        checkout_url = gerar_checkout(user_id, plano)
+        fila_envio.enviar(
+            "send_message",
+            chat_id=chat_id,
+            text="💳 Clique no botão abaixo para pagar com Mercado Pago.\n\n💡 Após o pagamento, aguarde a confirmação automática aqui mesmo.",
+            reply_markup=telegram.InlineKeyboardMarkup([
+                [telegram.InlineKeyboardButton("💳 Pagar com Mercado Pago", url=checkout_url)]
+            ])
+        )
+    return handler
+
+for _plano in PLANOS:
+    botao(f"pagar_{_plano}")(_pagar(_plano))
+
+def _plano_invalido(chat_id, user_id):
+    fila_envio.enviar("send_message", chat_id=chat_id, text="Plano inválido.")
+
+@botao("planos")
+def _planos(chat_id, user_id):
+    fila_envio.enviar("send_message", chat_id=chat_id, text=TEXTO_PLANOS,
+                      parse_mode=telegram.ParseMode.MARKDOWN, reply_markup=TECLADO_VOLTAR)
+
+@botao("ajuda")
+def _ajuda(chat_id, user_id):
+    fila_envio.enviar("send_message", chat_id=chat_id, text=TEXTO_AJUDA,
+                      parse_mode=telegram.ParseMode.MARKDOWN, reply_markup=TECLADO_VOLTAR)
+
+@botao("voltar_menu")
+def _voltar_menu(chat_id, user_id):
+    fila_envio.enviar("send_message", chat_id=chat_id, text="Escolha uma opção:", reply_markup=TECLADO_MENU)
+
+
+# === Registro de Pagamentos Processados ===
+
+STATUS_FINAIS = {"approved", "rejected", "cancelled", "refunded", "charged_back"}
+PAGAMENTO_RESERVA = 300
+# Quantos ids de pagamento cada assinante guarda para não aplicar a mesma renovação duas vezes
+PAGAMENTOS_APLICADOS = 20
+
+
+class RegistroPagamentos(BancoSQLite):
+    """Livro dos pagamentos que já chegaram a um status final.
+
+    O Mercado Pago notifica o mesmo pagamento várias vezes (payment, merchant_order e
+    reenvios). Um pagamento finalizado é tratado uma única vez, e notificações simultâneas
+    do mesmo pagamento esperam a primeira terminar em vez de consultá-lo de novo. Entre
+    processos, a reserva em `pagamentos_reservados` garante um único tratamento por vez.
+    """
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        self._finalizados = set()
+        self._em_andamento = {}
+        self._lock = Lock()
+        with self._conexao() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS pagamentos_processados ("
+                " payment_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " processado TEXT NOT NULL)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS pagamentos_reservados ("
+                " payment_id TEXT PRIMARY KEY,"
+                " dono TEXT NOT NULL,"
+                " reservado REAL NOT NULL)"
+            )
+
+    def finalizado(self, payment_id):
+        payment_id = str(payment_id)
+        if payment_id in self._finalizados:
+            return True
+        linha = self._conexao().execute(
+            "SELECT 1 FROM pagamentos_processados WHERE payment_id = ?", (payment_id,)
+        ).fetchone()
+        if linha:
+            self._finalizados.add(payment_id)
+        return linha is not None
+
+    def registrar(self, payment_id, status):
+        with self._conexao() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO pagamentos_processados (payment_id, status, processado) VALUES (?, ?, ?)",
+                (str(payment_id), status, datetime.now().isoformat(timespec="seconds"))
+            )
+        self._finalizados.add(str(payment_id))
+
+    def _reservar(self, payment_id):
+        agora = time.time()
+        with self._conexao() as con:
+            con.execute(
+                "DELETE FROM pagamentos_reservados WHERE payment_id = ? AND reservado < ?",
+                (payment_id, agora - PAGAMENTO_RESERVA)
+            )
+            cursor = con.execute(
+                "INSERT OR IGNORE INTO pagamentos_reservados (payment_id, dono, reservado) VALUES (?, ?, ?)",
+                (payment_id, PROCESSO, agora)
+            )
+        return cursor.rowcount == 1
+
+    def _liberar(self, payment_id):
+        with self._conexao() as con:
+            con.execute(
+                "DELETE FROM pagamentos_reservados WHERE payment_id = ? AND dono = ?", (payment_id, PROCESSO)
+            )
+
+    def tratar(self, payment_id, funcao):
+        """Executa `funcao(payment_id)` se o pagamento não estiver finalizado nem em tratamento."""
+        payment_id = str(payment_id)
+        with self._lock:
+            evento = self._em_andamento.get(payment_id)
+            dono = evento is None
+            if dono:
+                evento = self._em_andamento[payment_id] = Event()
+        if not dono:
+            evento.wait()
+            return
+        try:
+            if not self.finalizado(payment_id) and self._reservar(payment_id):
+                try:
+                    # Outro processo pode ter finalizado o pagamento e liberado a reserva
+                    # entre a consulta acima e a reserva
+                    if not self.finalizado(payment_id):
+                        funcao(payment_id)
+                finally:
+                    self._liberar(payment_id)
+        finally:
+            with self._lock:
+                del self._em_andamento[payment_id]
+            evento.set()
+
+
+registro_pagamentos = None
+
+# === Processamento de Pagamento ===
+
+def processar_pagamento(payment_id):
+    if payment_id is None or registro_pagamentos.finalizado(payment_id):
+        return
+    registro_pagamentos.tratar(payment_id, _processar_pagamento)
+
+
+def _processar_pagamento(payment_id):
+    with metricas.medir("bot_mercadopago_segundos", chamada="payment.get"):
+        payment_info = sdk.payment().get(payment_id)
+    response = payment_info.get("response", {})
+    status = response.get("status")
+    _aplicar_pagamento(payment_id, response, status)
+    if status in STATUS_FINAIS:
+        registro_pagamentos.registrar(payment_id, status)
+
+
+def _aplicar_pagamento(payment_id, response, status):
+    preference_id = response.get("preference_id")
+
+    if not preference_id:
+        order_id = response.get("order", {}).get("id")
+        if order_id:
+            try:
+                with metricas.medir("bot_mercadopago_segundos", chamada="merchant_order.get"):
+                    order_info = sdk.merchant_order().get(order_id)
+                preference_id = order_info["response"].get("preference_id")
+            except Exception as e:
+                print(f"Erro ao buscar merchant_order: {e}")
+
+    if not preference_id:
+        print("❌ Erro: 'preference_id' não encontrado na resposta do pagamento.")
+        return
+
+    temp = carregar_temp_pagamento(preference_id)
+    if not temp:
+        return
+
+    telegram_id = temp["telegram_id"]
+    plano = temp["plano"]
+    dias = PLANOS.get(plano, {}).get("dias", 30)
+
+    if status == "approved" and telegram_id:
+        # Assinante ativo que já está no grupo: o chat com o bot existe e não precisa de convite
+        membro = membros.obter(telegram_id)
+        no_grupo = _assinatura_ativa(telegram_id) and membro is not None and membro["status"] in STATUS_MEMBRO
+        if not no_grupo:
+            try:
+                with metricas.medir("bot_telegram_segundos", metodo="get_chat"):
+                    BOT.get_chat(chat_id=telegram_id)
+            except telegram.error.BadRequest:
+                print(f"❌ Chat {telegram_id} não encontrado. Pagamento aprovado, mas não foi possível enviar a mensagem.")
+                return
+
+        info = armazenamento.atualizar(telegram_id, partial(_renovar, dias, pagamento_id=str(payment_id)))
+        quitar_temp_pagamento(preference_id)
+        if info is None:
+            # Notificação reprocessada depois que a renovação já foi gravada
+            print(f"ℹ️ Pagamento {payment_id} já aplicado à assinatura de {telegram_id}.")
+            return
+        eventos.registrar("pagamento", telegram_id, plano, PLANOS.get(plano, {}).get("valor"))
+
+        if no_grupo:
+            fila_envio.enviar("send_message", chat_id=telegram_id,
+                              text=f"✅ Pagamento aprovado! Sua assinatura foi renovada até {_data_br(info['vencimento'])}.")
+        else:
+            fila_envio.executar(_liberar_acesso, telegram_id, info["vencimento"])
+
+
+def _renovar(dias, info, nome=None, pagamento_id=None):
+    """Soma `dias` ao que resta da assinatura: a partir do vencimento, se ainda não passou, ou de hoje.
+
+    Com `pagamento_id`, retorna None se esse pagamento já renovou a assinatura, para que
+    reprocessar a mesma notificação não some o período de novo.
+    """
+    info = info or {}
+    if pagamento_id is not None:
+        aplicados = info.get("pagamentos_aplicados", [])
+        if pagamento_id in aplicados:
+            return None
+        info["pagamentos_aplicados"] = (aplicados + [pagamento_id])[-PAGAMENTOS_APLICADOS:]
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    inicio = hoje
+    if info.get("status") == "ativo" and info.get("vencimento", "") > hoje:
+        inicio = info["vencimento"]
+    info.update({
+        "pagamento": hoje,
+        "vencimento": (_data_iso(inicio) + timedelta(days=dias)).strftime("%Y-%m-%d"),
+        "status": "ativo"
+    })
+    if nome is not None:
+        info["nome"] = nome
+    return info
+
+
+def _liberar_acesso(chamar, telegram_id, vencimento):
+    try:
+        _enviar_convite(chamar, telegram_id, f"✅ Pagamento aprovado! Sua assinatura vai até {_data_br(vencimento)}.\n\n"
+                                             "☚ Acesse o grupo com este link (válido por 10 minutos e para 1 uso):\n{link}")
+        membros.marcar_convite(telegram_id)
+    except Exception as e:
+        print(f"Erro ao criar link de convite: {e}")
+        chamar("send_message", chat_id=telegram_id, text="⚠️ Pagamento aprovado, mas houve erro ao gerar o link de convite. Contate o suporte.")
+
+
+# === Rota de Notificação Mercado Pago ===
+
+@rotas.route("/notificacao", methods=["POST"])
+def notificacao():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or data.get("type") not in ("payment", "merchant_order"):
+        return "ignorado"
+
+    if PROCESSAMENTO_ASSINCRONO:
+        fila_atualizacoes.registrar("mercadopago", data)
+    else:
+        processar_notificacao(data)
+    return "ok"
+
+
+@prazo(HTTP_PRAZO_WEBHOOK)
+def processar_notificacao(data):
+    if data.get("type") == "payment":
+        payment_id = data.get("data", {}).get("id")
+        processar_pagamento(payment_id)
+
+    elif data.get("type") == "merchant_order":
+        order_id = data.get("data", {}).get("id")
+        with metricas.medir("bot_mercadopago_segundos", chamada="merchant_order.get"):
+            order_info = sdk.merchant_order().get(order_id)
+        payments = order_info["response"].get("payments", [])
+
+        for payment in payments:
+            if payment["status"] == "approved" and not registro_pagamentos.finalizado(payment["id"]):
+                processar_pagamento(payment["id"])
+
+# === Reconciliação entre Assinantes e o Grupo ===
+
+STATUS_MEMBRO = {"creator", "administrator", "member", "restricted"}
+RECONCILIACAO_INTERVALO = int(os.getenv("RECONCILIACAO_INTERVALO", "3600"))
+RECONCILIACAO_LOTE = int(os.getenv("RECONCILIACAO_LOTE", "100"))
+RECONCILIACAO_PARALELO = int(os.getenv("RECONCILIACAO_PARALELO", "4"))
+CONVITE_INTERVALO = int(os.getenv("CONVITE_INTERVALO_HORAS", "72")) * 3600
+
+
+class IndiceMembros(BancoSQLite):
+    """Situação conhecida de cada usuário no grupo.
+
+    Alimentado pelos updates chat_member (o webhook precisa de "chat_member" em
+    allowed_updates e o bot precisa ser administrador do grupo), pelas remoções feitas pelo
+    bot e por get_chat_member quando a situação ainda é desconhecida.
+    """
+
+    def __init__(self, caminho):
+        super().__init__(caminho)
+        with self._conexao() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS membros ("
+                " uid TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " atualizado REAL NOT NULL,"
+                " convite REAL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS idx_membros_status ON membros (status, uid)")
+
+    def registrar(self, uid, status):
+        with self._conexao() as con:
+            con.execute(
+                "INSERT INTO membros (uid, status, atualizado) VALUES (?, ?, ?)"
+                " ON CONFLICT(uid) DO UPDATE SET status = excluded.status, atualizado = excluded.atualizado",
+                (str(uid), status, time.time())
+            )
+
+    def presumir_membro(self, uid, desde):
+        """Quem pagou provavelmente entrou no grupo. Só não vale se a situação registrada depois
+        do pagamento (timestamp `desde`) diz o contrário, ou se ele administra o grupo."""
+        with self._conexao() as con:
+            con.execute(
+                "INSERT INTO membros (uid, status, atualizado) VALUES (?, 'member', ?)"
+                " ON CONFLICT(uid) DO UPDATE SET status = 'member', atualizado = excluded.atualizado"
+                " WHERE membros.status NOT IN ('creator', 'administrator')"
+                " AND (membros.status = 'convidado' OR membros.atualizado < ?)",
+                (str(uid), time.time(), desde)
+            )
+
+    def obter(self, uid):
+        linha = self._conexao().execute("SELECT status, convite FROM membros WHERE uid = ?", (str(uid),)).fetchone()
+        return {"status": linha[0], "convite": linha[1]} if linha else None
+
+    def marcar_convite(self, uid):
+        """Registra o envio de um convite; quem ainda não tinha situação conhecida fica como 'convidado'."""
+        agora = time.time()
+        with self._conexao() as con:
+            con.execute(
+                "INSERT INTO membros (uid, status, atualizado, convite) VALUES (?, 'convidado', ?, ?)"
+                " ON CONFLICT(uid) DO UPDATE SET convite = excluded.convite",
+                (str(uid), agora, agora)
+            )
+
+    def membros_apos(self, apos="", limite=100):
+        """Próximos `limite` membros comuns do grupo (sem criador e administradores), em ordem de uid."""
+        linhas = self._conexao().execute(
+            "SELECT uid FROM membros WHERE status IN ('member', 'restricted') AND uid > ? ORDER BY uid LIMIT ?",
+            (apos, limite)
+        )
+        return [uid for (uid,) in linhas]
+
+
+class Reconciliacao(BancoSQLite):
+    """Acerta o grupo com a base de assinantes, em lotes e com ponto de retomada.
+
+    Fase "remocoes": membros do grupo sem assinatura ativa são removidos (ban + unban).
+    Fase "convites": assinantes ativos que não estão no grupo recebem um novo convite,
+    no máximo um a cada CONVITE_INTERVALO. Ao fim de cada lote a fase e o último uid são
+    gravados, e uma execução interrompida recomeça dali.
+    """
+
+    def __init__(self, caminho, membros):
+        super().__init__(caminho)
+        self.membros = membros
+        self._ultima = 0
+        with self._conexao() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS reconciliacao (chave TEXT PRIMARY KEY, fase TEXT NOT NULL, cursor TEXT NOT NULL)")
+
+    def _checkpoint(self):
+        linha = self._conexao().execute("SELECT fase, cursor FROM reconciliacao WHERE chave = 'grupo'").fetchone()
+        return linha or ("remocoes", "")
+
+    def _salvar(self, fase, cursor):
+        with self._conexao() as con:
+            con.execute("INSERT OR REPLACE INTO reconciliacao (chave, fase, cursor) VALUES ('grupo', ?, ?)", (fase, cursor))
+
+    def executar_se_devido(self, forcar=False):
+        if forcar or time.time() - self._ultima >= RECONCILIACAO_INTERVALO:
+            self.executar()
+
+    @metricas.medir("bot_reconciliacao_segundos")
+    def executar(self):
+        fase, cursor = self._checkpoint()
+        if fase == "remocoes":
+            while lote := self.membros.membros_apos(cursor, RECONCILIACAO_LOTE):
+                self._em_lote(self._remover, [uid for uid in lote if not _assinatura_ativa(uid)])
+                cursor = lote[-1]
+                self._salvar(fase, cursor)
+            fase, cursor = "convites", ""
+            self._salvar(fase, cursor)
+
+        while lote := armazenamento.uids_por_status("ativo", cursor, RECONCILIACAO_LOTE):
+            self._em_lote(self._convidar, [uid for uid in lote if self._precisa_convite(uid)])
+            cursor = lote[-1]
+            self._salvar(fase, cursor)
+
+        self._salvar("remocoes", "")
+        self._ultima = time.time()
+
+    @staticmethod
+    def _em_lote(funcao, uids):
+        # Chamadas paralelas, limitadas pelos baldes da fila de envio
+        if uids:
+            with ThreadPoolExecutor(RECONCILIACAO_PARALELO) as executor:
+                list(executor.map(funcao, uids))
+
+    def _remover(self, uid):
+        try:
+            fila_envio.chamar("ban_chat_member", chat_id=GROUP_ID, user_id=int(uid))
+            fila_envio.chamar("unban_chat_member", chat_id=GROUP_ID, user_id=int(uid))
+            self.membros.registrar(uid, "left")
+            metricas.incrementar("bot_reconciliacao_total", acao="remocao")
+        except Exception as e:
+            print(f"Erro ao remover {uid} do grupo: {e}")
+
+    def _precisa_convite(self, uid):
+        membro = self.membros.obter(uid)
+        if membro is None:
+            return True
+        if membro["status"] in STATUS_MEMBRO or membro["status"] == "kicked":
+            return False
+        return not membro["convite"] or time.time() - membro["convite"] >= CONVITE_INTERVALO
+
+    def _convidar(self, uid):
+        try:
+            if self.membros.obter(uid) is None:
+                status = fila_envio.chamar("get_chat_member", chat_id=GROUP_ID, user_id=int(uid)).status
+                self.membros.registrar(uid, status)
+                if status in STATUS_MEMBRO or status == "kicked":
+                    return
+            # Marcado antes do envio: quem bloqueou o bot só recebe nova tentativa (e novo
+            # link) depois de CONVITE_INTERVALO, não a cada reconciliação
+            self.membros.marcar_convite(uid)
+            _enviar_convite(
+                fila_envio.chamar, int(uid),
+                "🔗 Sua assinatura está ativa, mas você ainda não entrou no grupo. "
+                "Use este link (válido por 10 minutos e para 1 uso):\n{link}"
+            )
+            metricas.incrementar("bot_reconciliacao_total", acao="convite")
+        except Exception as e:
+            print(f"Erro ao reenviar convite para {uid}: {e}")
+
+
+def _assinatura_ativa(uid):
+    info = armazenamento.obter(uid)
+    return bool(info) and info.get("status") == "ativo"
+
+
+membros = reconciliacao = None
+
+# === Verificação Diária de Vencimentos ===
+
+@metricas.medir("bot_verificacao_segundos")
+def executar_verificacao():
+    preferencias.expirar()
+
+    hoje = datetime.now().date()
+    amanha = (hoje + timedelta(days=1)).strftime("%Y-%m-%d")
+    hoje = hoje.strftime("%Y-%m-%d")
+
+    # Eventos do histórico, gravados juntos no fim
+    ocorridos = []
+    with armazenamento.lote():
+        # Aviso de véspera: enviado uma única vez por ciclo (marcado com o vencimento avisado).
+        # Cada registro é remarcado numa transação, então uma renovação concorrente não é perdida.
+        for uid, _ in armazenamento.a_lembrar(amanha):
+            if armazenamento.atualizar(uid, partial(_marcar_aviso, amanha)):
+                fila_envio.enviar("send_message", chat_id=int(uid), text="⏳ Sua assinatura vence amanhã. Renove para continuar no grupo sem interrupções.")
+                ocorridos.append(("aviso", uid, None, None))
+
+        # A remoção do grupo fica com a reconciliação, que roda logo em seguida se alguém expirou
+        expirados = 0
+        for uid, _ in armazenamento.expirados(hoje):
+            info = armazenamento.atualizar(uid, partial(_marcar_expirado, hoje))
+            if info:
+                fila_envio.enviar("send_message", chat_id=int(uid), text="⚠️ Sua assinatura expirou. Você será removido do grupo.")
+                membros.presumir_membro(uid, _data_iso(info.get("pagamento") or hoje).timestamp())
+                ocorridos.append(("expiracao", uid, None, None))
+                expirados += 1
+    eventos.registrar_varios(ocorridos)
+
+    reconciliacao.executar_se_devido(forcar=expirados > 0)
+
+def _marcar_aviso(data, info):
+    if not info or info.get("status") != "ativo" or info.get("vencimento") != data or info.get("aviso_enviado") == data:
+        return None
+    info["aviso_enviado"] = data
+    return info
+
+def _marcar_expirado(hoje, info):
+    if not info or info.get("status") != "ativo" or info.get("vencimento") >= hoje:
+        return None
+    info["status"] = "inativo"
+    return info
+
+
+class Lideranca:
+    """Eleição de líder por lock de arquivo: só o processo que o detém roda o agendador.
+
+    O lock é liberado pelo sistema quando o processo morre, e outro worker assume.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._arquivo = None
+
+    def lider(self):
+        if self._arquivo is not None:
+            return True
+        arquivo = open(self.caminho, "a")
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            arquivo.close()
+            return False
+        self._arquivo = arquivo
+        print(f"📅 Processo {PROCESSO} assumiu a verificação de vencimentos.")
+        return True
+
+
+lideranca = None
+metricas.medidor("bot_agendador_lider", lambda: int(lideranca is not None and lideranca._arquivo is not None))
+
+def verificar_vencimentos():
+    while True:
+        time.sleep(30)
+        if not lideranca.lider():
+            continue
+        try:
+            executar_verificacao()
+        except Exception as e:
+            print(f"Erro na verificação de vencimentos: {e}")
+
+async def verificar_vencimentos_async():
+    import asyncio
+
+    while True:
+        await asyncio.sleep(30)
+        if not lideranca.lider():
+            continue
+        try:
+            await asyncio.to_thread(executar_verificacao)
+        except Exception as e:
+            print(f"Erro na verificação de vencimentos: {e}")
+
+fila_atualizacoes = None
+metricas.medidor("bot_fila_atualizacoes_tamanho", lambda: fila_atualizacoes.pendentes.qsize() if fila_atualizacoes else 0)
+metricas.medidor("bot_fila_atualizacoes_falhas", lambda: fila_atualizacoes.falhas() if fila_atualizacoes else 0)
+
+# === Inicialização ===
+
+def abrir_bancos():
+    """Abre os bancos do processo: cria as tabelas na primeira vez e importa os JSON legados."""
+    global armazenamento, preferencias, registro_pagamentos, eventos, membros, reconciliacao
+    global lideranca, fila_atualizacoes
+    configurar()
+    armazenamento = criar_armazenamento()
+    preferencias = Medido(PreferenciasPendentes(DB_SQLITE), "bot_preferencias_segundos")
+    registro_pagamentos = RegistroPagamentos(DB_SQLITE)
+    eventos = RegistroEventos(DB_SQLITE)
+    membros = IndiceMembros(DB_SQLITE)
+    reconciliacao = Reconciliacao(DB_SQLITE, membros)
+    lideranca = Lideranca(AGENDADOR_LOCK)
+    fila_atualizacoes = FilaAtualizacoes(FILA_DB, {
+        "telegram": processar_update,
+        "mercadopago": processar_notificacao,
+    })
+
+_servicos_iniciados = False
+_servicos_lock = Lock()
+
+def iniciar_servicos(agendador=None):
+    """Lê a configuração, abre os bancos e sobe as filas em segundo plano e, conforme
+    AGENDADOR, a thread de vencimentos.
+
+    Importar o módulo não lê a configuração da instalação, não cria arquivos nem threads;
+    isto roda uma vez por processo, em `criar_app` ou na primeira requisição.
+    """
+    global _servicos_iniciados
+    if _servicos_iniciados:
+        return
+    with _servicos_lock:
+        if _servicos_iniciados:
+            return
+        abrir_bancos()
+        if eventos.vazio():
+            eventos.importar(_uids_ativos())
+        fila_envio.iniciar()
+        fila_atualizacoes.iniciar()
+        if (agendador or AGENDADOR) == "thread":
+            Thread(target=verificar_vencimentos, daemon=True).start()
+        elif agendador is None and AGENDADOR == "nenhum":
+            print("⚠️ AGENDADOR=nenhum: este processo não verifica vencimentos. "
+                  "Suba `python MPbot.py agendador` à parte, senão lembretes e remoções não acontecem.")
+        _servicos_iniciados = True
+
+def criar_app(agendador=None):
+    """Fábrica para o gunicorn: `gunicorn "MPbot:criar_app()"`.
+
+    Sobe os serviços do processo e devolve um app Flask novo com as rotas do bot.
+    """
+    iniciar_servicos(agendador)
+    novo = Flask(__name__)
+    novo.register_blueprint(rotas)
+    return novo
+
+@rotas.before_app_request
+def _iniciar_na_primeira_requisicao():
+    # Para quem ainda sobe com `gunicorn MPbot:app`
+    iniciar_servicos()
+
+# App pronto para `gunicorn MPbot:app`; os serviços sobem na primeira requisição
+app = Flask(__name__)
+app.register_blueprint(rotas)
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ["agendador"]:
+        # Processo só de agendador, para rodar os workers web com AGENDADOR=nenhum
+        iniciar_servicos(agendador="nenhum")
+        print("Rodando só a verificação de vencimentos.")
+        verificar_vencimentos()
+    elif sys.argv[1:] == ["reprocessar"]:
+        abrir_bancos()
+        print(f"🔁 {fila_atualizacoes.reprocessar_falhas()} atualização(ões) devolvida(s) à fila.")
+    else:
+        # Um processo só: ele mesmo roda a verificação de vencimentos
+        print("Rodando localmente. Em produção, use gunicorn.")
+        criar_app(agendador="thread").run(host='0.0.0.0', port=5000)
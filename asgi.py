@@ -0,0 +1,242 @@
+"""Modo assíncrono (ASGI) do MPbot.
+
+    uvicorn asgi:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app
+
+Os webhooks (`/` e `/notificacao`) são tratados no event loop: o corpo é filtrado e gravado
+na fila persistente de atualizações, em lote com as outras entregas que chegaram junto, sem
+ocupar uma thread por requisição. O resto (`/painel`, `/logout`, `/metrics`) passa pelo app
+Flask numa thread. A verificação de vencimentos roda como tarefa asyncio.
+
+As chamadas ao Telegram e ao Mercado Pago continuam nos workers da fila, com os clientes
+HTTP com pool do MPbot.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+os.environ.setdefault("AGENDADOR", "asyncio")
+
+import MPbot
+
+INGESTAO_LOTE = int(os.getenv("INGESTAO_LOTE", "200"))
+
+
+class Ingestao:
+    """Junta as atualizações recebidas ao mesmo tempo numa única transação da fila persistente.
+
+    Cada requisição espera a gravação do seu lote antes de responder, como no modo Flask.
+    Sem `fila`, grava na fila do MPbot, aberta ao subir os serviços.
+    """
+
+    def __init__(self, fila=None, lote=INGESTAO_LOTE):
+        self.fila = fila
+        self.lote = lote
+        self._pendentes = None
+        self._gravador = None
+
+    async def registrar(self, origem, corpo):
+        if self._pendentes is None:
+            self._pendentes = asyncio.Queue()
+        if self._gravador is None or self._gravador.done():
+            # Sem gravador, as requisições esperariam para sempre: sobe outro se ele morreu
+            self._gravador = asyncio.create_task(self._gravar())
+        gravado = asyncio.get_running_loop().create_future()
+        await self._pendentes.put((origem, corpo, gravado))
+        await gravado
+
+    async def _gravar(self):
+        while True:
+            itens = [await self._pendentes.get()]
+            while len(itens) < self.lote and not self._pendentes.empty():
+                itens.append(self._pendentes.get_nowait())
+            # Uma requisição cancelada enquanto esperava (cliente desconectou) já tem o
+            # futuro resolvido; ele é pulado para não derrubar o gravador
+            try:
+                fila = self.fila or MPbot.fila_atualizacoes
+                await asyncio.to_thread(fila.registrar_lote, [(origem, corpo) for origem, corpo, _ in itens])
+            except asyncio.CancelledError:
+                for _, _, gravado in itens:
+                    if not gravado.done():
+                        gravado.cancel()
+                raise
+            except Exception as e:
+                for _, _, gravado in itens:
+                    if not gravado.done():
+                        gravado.set_exception(e)
+            else:
+                for _, _, gravado in itens:
+                    if not gravado.done():
+                        gravado.set_result(None)
+
+
+ingestao = Ingestao()
+
+
+async def _ler_corpo(receive):
+    partes = []
+    while True:
+        mensagem = await receive()
+        partes.append(mensagem.get("body", b""))
+        if not mensagem.get("more_body"):
+            return b"".join(partes)
+
+
+async def _responder(send, texto, status=200):
+    corpo = texto.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(corpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": corpo})
+
+
+def _json(corpo):
+    try:
+        return json.loads(corpo)
+    except ValueError:
+        return None
+
+
+async def webhook(scope, receive, send):
+    if scope["method"] in ("GET", "HEAD"):
+        return await _responder(send, "Bot de pagamento está ativo.")
+
+    dados = _json(await _ler_corpo(receive))
+    if not isinstance(dados, dict) or "update_id" not in dados or not MPbot.update_relevante(dados):
+        return await _responder(send, "ignorado")
+
+    if MPbot.PROCESSAMENTO_ASSINCRONO:
+        await ingestao.registrar("telegram", dados)
+    else:
+        await asyncio.to_thread(MPbot.processar_update, dados)
+    await _responder(send, "ok")
+
+
+async def notificacao(scope, receive, send):
+    data = _json(await _ler_corpo(receive))
+    if not isinstance(data, dict) or data.get("type") not in ("payment", "merchant_order"):
+        return await _responder(send, "ignorado")
+
+    if MPbot.PROCESSAMENTO_ASSINCRONO:
+        await ingestao.registrar("mercadopago", data)
+    else:
+        await asyncio.to_thread(MPbot.processar_notificacao, data)
+    await _responder(send, "ok")
+
+
+ROTAS = {
+    ("/", "GET"): webhook,
+    ("/", "HEAD"): webhook,
+    ("/", "POST"): webhook,
+    ("/notificacao", "POST"): notificacao,
+}
+
+
+async def ponte_wsgi(scope, receive, send, wsgi=MPbot.app):
+    """Atende a requisição com o app WSGI numa thread, repassando a resposta em partes
+    (o /painel é gerado em streaming)."""
+    corpo = await _ler_corpo(receive)
+    servidor, porta = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": servidor,
+        "SERVER_PORT": str(porta),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(corpo)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(corpo),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for nome, valor in scope["headers"]:
+        nome = nome.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nome not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            nome = "HTTP_" + nome
+        environ[nome] = f"{environ[nome]},{valor}" if nome in environ and nome.startswith("HTTP_") else valor
+
+    loop = asyncio.get_running_loop()
+    inicio = {}
+
+    def start_response(status, cabecalhos, exc_info=None):
+        inicio["status"] = int(status.split(" ", 1)[0])
+        inicio["headers"] = [(nome.lower().encode("latin-1"), valor.encode("latin-1")) for nome, valor in cabecalhos]
+
+    def enviar(mensagem):
+        asyncio.run_coroutine_threadsafe(send(mensagem), loop).result()
+
+    def executar():
+        resposta = wsgi(environ, start_response)
+        try:
+            enviado = False
+            for parte in resposta:
+                if not enviado:
+                    enviar({"type": "http.response.start", **inicio})
+                    enviado = True
+                if parte:
+                    enviar({"type": "http.response.body", "body": parte, "more_body": True})
+            if not enviado:
+                enviar({"type": "http.response.start", **inicio})
+            enviar({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(resposta, "close"):
+                resposta.close()
+
+    await asyncio.to_thread(executar)
+
+
+_agendador = None
+
+
+def _iniciar():
+    """Sobe os serviços do MPbot e, com AGENDADOR=asyncio, a tarefa de vencimentos neste loop."""
+    global _agendador
+    MPbot.iniciar_servicos()
+    if _agendador is None and MPbot.AGENDADOR == "asyncio":
+        _agendador = asyncio.create_task(MPbot.verificar_vencimentos_async())
+
+
+async def _ciclo_de_vida(receive, send):
+    global _agendador
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "lifespan.startup":
+            _iniciar()
+            await send({"type": "lifespan.startup.complete"})
+        elif mensagem["type"] == "lifespan.shutdown":
+            if _agendador is not None:
+                _agendador.cancel()
+                _agendador = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _ciclo_de_vida(receive, send)
+    if scope["type"] != "http":
+        return
+    # Servidores sem lifespan: sobe as filas e o agendador na primeira requisição
+    _iniciar()
+
+    rota = ROTAS.get((scope["path"], scope["method"]))
+    if rota is None:
+        return await ponte_wsgi(scope, receive, send)
+
+    # As rotas do Flask são medidas no after_request; estas, aqui
+    inicio = time.perf_counter()
+    await rota(scope, receive, send)
+    MPbot.metricas.observar("bot_http_segundos", time.perf_counter() - inicio, rota=scope["path"])
+    MPbot.metricas.incrementar("bot_http_respostas_total", rota=scope["path"], status=200)
@@ -0,0 +1,897 @@
+"""Benchmark do MPbot com Telegram e Mercado Pago falsos.
+
+Roda as rotas do bot em memória (Flask test client), num diretório temporário, com
+clientes falsos de latência e taxa de erro configuráveis, e mostra p50/p99 e
+requisições por segundo de cada rota. No fim, simula a verificação diária de
+vencimentos com N assinantes.
+
+    python benchmark.py --requisicoes 500 --concorrencia 8 --assinantes 10000
+    python benchmark.py --sincrono --latencia-telegram 0.05 --latencia-mp 0.2
+
+Com --http-local, os clientes de verdade (do MPbot, ou os padrão das bibliotecas com
+--clientes-padrao) falam com um servidor HTTP local que imita as duas APIs, e o
+resultado inclui quantas conexões foram abertas para quantas requisições.
+
+Com --asgi, as rotas são chamadas no app ASGI (asgi.py) em vez do Flask, com as
+requisições concorrentes como corrotinas no lugar de threads:
+
+    python benchmark.py --concorrencia 1000 --requisicoes 5000 --rotas /start payment
+    python benchmark.py --concorrencia 1000 --requisicoes 5000 --rotas /start payment --asgi
+
+Com --armazenamento, compara a latência de cada operação no SQLite e nas funções JSON
+antigas (o arquivo inteiro a cada chamada), com os números de assinantes dados:
+
+    python benchmark.py --armazenamento 1000 10000 100000
+
+Com --preferencias N, mede as consultas de checkouts pendentes com 1k, 10k... até N
+registros na tabela (python benchmark.py --preferencias 1000000).
+
+Com --painel N, gera o /painel (em streaming) com N assinantes e mostra o tempo até o
+primeiro byte, o tempo total e o pico de memória (tracemalloc) de cada consulta.
+
+Com --processos P, P processos fazem atualizar() no mesmo assinante ao mesmo tempo e
+disputam a liderança do agendador; confere que nenhum incremento se perdeu e que há um
+líder só, também depois que ele sai (python benchmark.py --processos 4 --backend json).
+
+Com --queda-gravacao K, mata (SIGKILL) K vezes um processo no meio da gravação do
+assinantes.json, com as funções JSON antigas e com o ArmazenamentoJSON, e confere se o
+arquivo ainda é lido com o conteúdo anterior ou o novo inteiro.
+
+Com --inicializacao N, mede só o boot, em N processos novos: o tempo de `import MPbot` e
+o tempo até o primeiro 200 em `/` com o servidor escolhido (--servidor).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.request import urlopen
+
+
+class ClienteFalso:
+    """Base dos clientes falsos: cada chamada espera `latencia` e falha com `taxa_erro`."""
+
+    def __init__(self, latencia=0.0, taxa_erro=0.0):
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.chamadas = {}
+        self._lock = threading.Lock()
+
+    def _chamada(self, nome):
+        with self._lock:
+            self.chamadas[nome] = self.chamadas.get(nome, 0) + 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.taxa_erro and random.random() < self.taxa_erro:
+            raise self.erro(f"Erro simulado em {nome}")
+
+
+class BotFalso(ClienteFalso):
+    """Faz o papel do telegram.Bot: aceita qualquer método e registra quantas vezes foi chamado."""
+
+    def __init__(self, latencia=0.0, taxa_erro=0.0):
+        super().__init__(latencia, taxa_erro)
+        import telegram
+        self.erro = telegram.error.NetworkError
+
+    def __getattr__(self, nome):
+        if nome.startswith("_"):
+            raise AttributeError(nome)
+
+        def metodo(**kwargs):
+            self._chamada(nome)
+            if nome == "create_chat_invite_link":
+                return type("ConviteFalso", (), {"invite_link": "https://t.me/+falso"})()
+            if nome == "get_chat_member":
+                return type("MembroFalso", (), {"status": "member"})()
+            return True
+        return metodo
+
+
+class SDKFalso(ClienteFalso):
+    """Faz o papel do mercadopago.SDK: todo pagamento consultado aparece como aprovado."""
+
+    erro = RuntimeError
+
+    def __init__(self, latencia=0.0, taxa_erro=0.0):
+        super().__init__(latencia, taxa_erro)
+        self._ids = count(1)
+
+    def preference(self):
+        sdk = self
+
+        class Preferencia:
+            def create(self, dados):
+                sdk._chamada("preference.create")
+                numero = next(sdk._ids)
+                return {"status": 201, "response": {"id": f"pref-{numero}", "init_point": f"https://mp.falso/{numero}"}}
+        return Preferencia()
+
+    def payment(self):
+        sdk = self
+
+        class Pagamento:
+            def get(self, payment_id):
+                sdk._chamada("payment.get")
+                return {"status": 200, "response": {"status": "approved", "preference_id": f"pref-pg-{payment_id}"}}
+        return Pagamento()
+
+    def merchant_order(self):
+        sdk = self
+
+        class Pedido:
+            def get(self, order_id):
+                sdk._chamada("merchant_order.get")
+                return {"status": 200, "response": {
+                    "preference_id": f"pref-pg-{order_id}",
+                    "payments": [{"id": order_id, "status": "approved"}],
+                }}
+        return Pedido()
+
+
+# === Servidor HTTP local ===
+
+MP_API = "https://api.mercadopago.com"
+_usuario_stub = {"id": 1, "is_bot": True, "first_name": "Bot"}
+
+RESPOSTAS_TELEGRAM = {
+    "sendMessage": lambda dados: {"message_id": 1, "date": int(time.time()),
+                                  "chat": {"id": int(dados.get("chat_id", 1)), "type": "private"}},
+    "getChat": lambda dados: {"id": int(dados.get("chat_id", 1)), "type": "private"},
+    "getChatMember": lambda dados: {"status": "member", "user": _usuario_stub},
+    "createChatInviteLink": lambda dados: {"invite_link": "https://t.me/+falso", "creator": _usuario_stub,
+                                           "is_primary": False, "is_revoked": False},
+}
+
+
+class StubHTTP(BaseHTTPRequestHandler):
+    """Imita a Bot API do Telegram e a API do Mercado Pago, com keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        servico = "mercadopago" if self.server.server_address[1] == self.server.porta_mp else "telegram"
+        self.server.contar("conexoes", servico)
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _corpo(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        bruto = self.rfile.read(tamanho) if tamanho else b""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(bruto or b"{}")
+        from urllib.parse import parse_qsl
+        return dict(parse_qsl(bruto.decode()))
+
+    def _tratar(self):
+        corpo = self._corpo()
+        if self.path.startswith("/bot"):
+            self.server.contar("requisicoes", "telegram")
+            time.sleep(self.server.latencia_telegram)
+            if random.random() < self.server.taxa_erro:
+                return self._responder(502, {"ok": False, "description": "Bad Gateway"})
+            metodo = self.path.rsplit("/", 1)[-1]
+            resultado = RESPOSTAS_TELEGRAM.get(metodo, lambda dados: True)(corpo)
+            return self._responder(200, {"ok": True, "result": resultado})
+
+        self.server.contar("requisicoes", "mercadopago")
+        time.sleep(self.server.latencia_mp)
+        if random.random() < self.server.taxa_erro:
+            return self._responder(502, {"message": "bad gateway"})
+        caminho = self.path.split("?")[0]
+        numero = caminho.rsplit("/", 1)[-1]
+        if caminho.startswith("/checkout/preferences"):
+            return self._responder(201, {"id": f"pref-{numero}-{random.random()}", "init_point": "https://mp.falso/1"})
+        if caminho.startswith("/v1/payments/"):
+            return self._responder(200, {"status": "approved", "preference_id": f"pref-pg-{numero}"})
+        if caminho.startswith("/merchant_orders/"):
+            return self._responder(200, {"preference_id": f"pref-pg-{numero}",
+                                         "payments": [{"id": numero, "status": "approved"}]})
+        return self._responder(404, {"message": "not found"})
+
+    do_GET = do_POST = _tratar
+
+
+class ServidorStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latencia_telegram, latencia_mp, taxa_erro):
+        super().__init__(("127.0.0.1", 0), StubHTTP)
+        self.latencia_telegram = latencia_telegram
+        self.latencia_mp = latencia_mp
+        self.taxa_erro = taxa_erro
+        self.porta_mp = None
+        self.contagem = {}
+        self._lock = threading.Lock()
+
+    def contar(self, nome, servico):
+        with self._lock:
+            self.contagem[(nome, servico)] = self.contagem.get((nome, servico), 0) + 1
+
+
+def iniciar_stub(args):
+    """Dois servidores (Telegram e Mercado Pago) com contagem compartilhada."""
+    telegram_stub = ServidorStub(args.latencia_telegram, args.latencia_mp, args.taxa_erro)
+    mp_stub = ServidorStub(args.latencia_telegram, args.latencia_mp, args.taxa_erro)
+    mp_stub.contagem, mp_stub._lock = telegram_stub.contagem, telegram_stub._lock
+    for servidor in (telegram_stub, mp_stub):
+        servidor.porta_mp = mp_stub.server_address[1]
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return telegram_stub, mp_stub
+
+
+def clientes_locais(telegram_stub, mp_stub, padrao):
+    """Clientes de verdade apontados para o servidor local."""
+    import mercadopago
+    import telegram
+    base_mp = f"http://127.0.0.1:{mp_stub.server_address[1]}"
+    base_telegram = f"http://127.0.0.1:{telegram_stub.server_address[1]}/bot"
+    token_telegram = os.environ["TELEGRAM_TOKEN"]
+
+    def redirecionar(classe):
+        class ClienteLocal(classe):
+            def request(self, method, url, *args, **kwargs):
+                return super().request(method, url.replace(MP_API, base_mp), *args, **kwargs)
+        return ClienteLocal
+
+    if padrao:
+        bot = telegram.Bot(token_telegram, base_url=base_telegram)
+        sdk_mp = mercadopago.SDK(os.environ["MP_ACCESS_TOKEN"], http_client=redirecionar(mercadopago.http.HttpClient)())
+    else:
+        bot = MPbot.criar_bot(base_url=base_telegram)
+        sdk_mp = MPbot.criar_sdk(http_client=redirecionar(MPbot.classe_http_mercadopago())())
+    return bot, sdk_mp
+
+
+# === Atualizações de exemplo ===
+
+_update_ids = count(1)
+_pagamento_ids = count(1)
+
+def _usuario(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"Usuário {uid}"}
+
+def mensagem(texto, uid):
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": 1, "date": int(time.time()), "text": texto,
+        "chat": {"id": uid, "type": "private"}, "from": _usuario(uid),
+    }}
+
+def callback(dados, uid):
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(uid), "chat_instance": "benchmark", "data": dados, "from": _usuario(uid),
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"}},
+    }}
+
+def notificacao(tipo, uid):
+    """Notificação de um pagamento novo, com o checkout pendente já registrado para o usuário."""
+    payment_id = str(next(_pagamento_ids))
+    MPbot.salvar_temp_pagamento(f"pref-pg-{payment_id}", uid, "mensal")
+    return {"type": tipo, "data": {"id": payment_id}}
+
+def renovacao(uid):
+    """Pagamento de quem já é assinante ativo e está no grupo."""
+    vencimento = (datetime.now().date() + timedelta(days=10)).isoformat()
+    MPbot.armazenamento.salvar(uid, {"nome": f"Usuário {uid}", "pagamento": vencimento,
+                                     "vencimento": vencimento, "status": "ativo"})
+    MPbot.membros.registrar(uid, "member")
+    return notificacao("payment", uid)
+
+CENARIOS = {
+    "/start": lambda uid: ("/", mensagem("/start", uid)),
+    "/status": lambda uid: ("/", mensagem("/status", uid)),
+    "pagar_mensal": lambda uid: ("/", callback("pagar_mensal", uid)),
+    "pagar_trimestral": lambda uid: ("/", callback("pagar_trimestral", uid)),
+    "payment": lambda uid: ("/notificacao", notificacao("payment", uid)),
+    "merchant_order": lambda uid: ("/notificacao", notificacao("merchant_order", uid)),
+    "renovacao": lambda uid: ("/notificacao", renovacao(uid)),
+}
+
+
+# === Execução ===
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(int(len(valores) * p), len(valores) - 1)]
+
+def aguardar_filas():
+    """Espera as filas de atualizações e de envio esvaziarem."""
+    con = MPbot.fila_atualizacoes._conexao()
+    while con.execute("SELECT COUNT(*) FROM atualizacoes").fetchone()[0]:
+        time.sleep(0.01)
+    MPbot.fila_envio.fila.join()
+
+def _enviar_asgi(corpos, concorrencia):
+    """Chama o app ASGI direto, com até `concorrencia` requisições em andamento."""
+    import asgi
+
+    async def enviar(corpo, limite):
+        rota, dados = corpo
+        mensagens = [{"type": "http.request", "body": json.dumps(dados).encode()}]
+        resposta = {}
+
+        async def receive():
+            return mensagens.pop() if mensagens else {"type": "http.disconnect"}
+
+        async def send(mensagem):
+            if mensagem["type"] == "http.response.start":
+                resposta["status"] = mensagem["status"]
+
+        escopo = {"type": "http", "method": "POST", "path": rota, "query_string": b"",
+                  "headers": [(b"content-type", b"application/json")]}
+        async with limite:
+            inicio = time.perf_counter()
+            await asgi.app(escopo, receive, send)
+            duracao = time.perf_counter() - inicio
+        assert resposta["status"] == 200, resposta
+        return duracao
+
+    async def enviar_todos():
+        limite = asyncio.Semaphore(concorrencia)
+        return await asyncio.gather(*(enviar(corpo, limite) for corpo in corpos))
+
+    return _loop_asgi.run_until_complete(enviar_todos())
+
+_loop_asgi = asyncio.new_event_loop()
+
+def medir_rota(nome, requisicoes, concorrencia, modo_asgi=False):
+    gerar = CENARIOS[nome]
+    corpos = [gerar(100000 + i % 1000) for i in range(requisicoes)]
+    local = threading.local()
+
+    def enviar(corpo):
+        cliente = getattr(local, "cliente", None)
+        if cliente is None:
+            cliente = local.cliente = MPbot.app.test_client()
+        rota, dados = corpo
+        inicio = time.perf_counter()
+        resposta = cliente.post(rota, json=dados)
+        duracao = time.perf_counter() - inicio
+        assert resposta.status_code == 200, resposta.status_code
+        return duracao
+
+    inicio = time.perf_counter()
+    if modo_asgi:
+        latencias = _enviar_asgi(corpos, concorrencia)
+    else:
+        with ThreadPoolExecutor(concorrencia) as executor:
+            latencias = list(executor.map(enviar, corpos))
+    total = time.perf_counter() - inicio
+    aguardar_filas()
+    processado = time.perf_counter() - inicio
+
+    print(f"{nome:<18} p50 {percentil(latencias, 0.5) * 1000:8.2f} ms   "
+          f"p99 {percentil(latencias, 0.99) * 1000:8.2f} ms   "
+          f"{requisicoes / total:9.1f} req/s   "
+          f"processado em {processado:6.2f} s")
+
+def medir_cpu_updates(repeticoes):
+    """Tempo de CPU gasto por update do Telegram em processar_update, fora do HTTP e das filas."""
+    ignorado = {"update_id": 0, "edited_message": mensagem("/start", 1)["message"]}
+    cenarios = {nome: gerar for nome, gerar in CENARIOS.items() if gerar(1)[0] == "/"}
+    cenarios["ignorado"] = lambda uid: ("/", dict(ignorado, update_id=next(_update_ids)))
+    for nome, gerar in cenarios.items():
+        corpos = [gerar(300000 + i % 100)[1] for i in range(repeticoes)]
+        inicio = time.thread_time()
+        for corpo in corpos:
+            if MPbot.update_relevante(corpo):
+                try:
+                    MPbot.processar_update(corpo)
+                except Exception:
+                    pass  # falhas simuladas (--taxa-erro)
+        cpu = (time.thread_time() - inicio) / repeticoes
+        print(f"{nome:<18} {cpu * 1e6:8.1f} µs de CPU por update")
+    aguardar_filas()
+
+def medir_vencimentos(assinantes):
+    hoje = datetime.now().date()
+    ontem = (hoje - timedelta(days=1)).isoformat()
+    amanha = (hoje + timedelta(days=1)).isoformat()
+    futuro = (hoje + timedelta(days=20)).isoformat()
+    # Um terço vence hoje, um terço recebe aviso e o resto não é tocado
+    MPbot.salvar_dados({
+        str(200000 + i): {
+            "nome": f"Assinante {i}",
+            "pagamento": hoje.isoformat(),
+            "vencimento": (ontem, amanha, futuro)[i % 3],
+            "status": "ativo",
+        }
+        for i in range(assinantes)
+    })
+
+    inicio = time.perf_counter()
+    MPbot.executar_verificacao()
+    verificacao = time.perf_counter() - inicio
+    MPbot.fila_envio.fila.join()
+    envio = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    MPbot.executar_verificacao()
+    repeticao = time.perf_counter() - inicio
+
+    print(f"vencimentos ({assinantes} assinantes): verificação {verificacao:.3f} s, "
+          f"envios concluídos em {envio:.2f} s, tick seguinte {repeticao * 1000:.2f} ms")
+
+
+class JSONLegado:
+    """carregar_dados/salvar_dados de antes do SQLite: o arquivo inteiro lido (ou regravado) a
+    cada operação."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+    def carregar_dados(self):
+        with self._lock:
+            if not os.path.exists(self.caminho):
+                return {}
+            with open(self.caminho, 'r') as f:
+                return json.load(f)
+
+    def salvar_dados(self, dados):
+        with self._lock:
+            with open(self.caminho, 'w') as f:
+                json.dump(dados, f, indent=4)
+
+
+def _assinantes(quantidade):
+    hoje = datetime.now().date()
+    return {
+        str(200000 + i): {
+            "nome": f"Assinante {i}",
+            "pagamento": hoje.isoformat(),
+            "vencimento": (hoje + timedelta(days=i % 60 - 10)).isoformat(),
+            "status": "ativo",
+        }
+        for i in range(quantidade)
+    }
+
+def _latencias(operacao, repeticoes):
+    latencias = []
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        operacao(i)
+        latencias.append(time.perf_counter() - inicio)
+    return latencias
+
+def medir_armazenamento(tamanhos):
+    """Latência por operação do SQLite e das funções JSON antigas, para cada número de assinantes."""
+    hoje = datetime.now().date().isoformat()
+    for tamanho in tamanhos:
+        dados = _assinantes(tamanho)
+        uids = list(dados)
+        legado = JSONLegado(f"legado-{tamanho}.json")
+        legado.salvar_dados(dados)
+        sqlite = MPbot.ArmazenamentoSQLite(f"assinantes-{tamanho}.db")
+        sqlite.substituir_todos(dados)
+        # O JSON antigo regrava o arquivo inteiro a cada operação: menos repetições nos maiores
+        repeticoes = max(5, min(200, 200000 // tamanho))
+
+        def gravar_legado(i):
+            todos = legado.carregar_dados()
+            todos[uids[i * 7919 % tamanho]]["aviso_enviado"] = hoje
+            legado.salvar_dados(todos)
+
+        def gravar_sqlite(i):
+            uid = uids[i * 7919 % tamanho]
+            sqlite.salvar(uid, dict(dados[uid], aviso_enviado=hoje))
+
+        operacoes = {
+            "ler um": (lambda i: legado.carregar_dados().get(uids[i * 7919 % tamanho]),
+                       lambda i: sqlite.obter(uids[i * 7919 % tamanho])),
+            "gravar um": (gravar_legado, gravar_sqlite),
+            "vencidos hoje": (lambda i: [u for u, info in legado.carregar_dados().items() if info["vencimento"] <= hoje],
+                              lambda i: sqlite.expirados(hoje)),
+        }
+        print(f"{tamanho} assinantes ({repeticoes} repetições)")
+        for nome, (com_legado, com_sqlite) in operacoes.items():
+            antes = _latencias(com_legado, repeticoes)
+            depois = _latencias(com_sqlite, repeticoes)
+            print(f"  {nome:<14} JSON p50 {percentil(antes, 0.5) * 1000:9.2f} ms  p99 {percentil(antes, 0.99) * 1000:9.2f} ms   "
+                  f"SQLite p50 {percentil(depois, 0.5) * 1000:7.3f} ms  p99 {percentil(depois, 0.99) * 1000:7.3f} ms")
+
+
+def medir_preferencias(maximo):
+    """Latência das consultas de checkouts pendentes com 1k, 10k... até `maximo` registros."""
+    preferencias = MPbot.PreferenciasPendentes("preferencias.db")
+    agora = time.time()
+    tamanho, total = 1000, 0
+    while tamanho <= maximo:
+        with preferencias._conexao() as con:
+            con.executemany(
+                "INSERT INTO preferencias (preference_id, telegram_id, plano, criado, url) VALUES (?, ?, ?, ?, ?)",
+                ((f"pref-{i}", 100000 + i % 50000, "mensal", agora - i % 86400, f"https://mp.falso/{i}")
+                 for i in range(total, tamanho))
+            )
+        total = tamanho
+        operacoes = {
+            "obter": lambda i: preferencias.obter(f"pref-{i * 7919 % total}"),
+            "obter ausente": lambda i: preferencias.obter(f"ausente-{i}"),
+            "pendente": lambda i: preferencias.pendente(100000 + i % 50000, "mensal", 86400),
+            "salvar": lambda i: preferencias.salvar(f"nova-{total}-{i}", 100000 + i, "mensal", "https://mp.falso/nova"),
+        }
+        resultados = []
+        for nome, operacao in operacoes.items():
+            latencias = _latencias(operacao, 2000)
+            resultados.append(f"{nome} p50 {percentil(latencias, 0.5) * 1e6:6.1f} µs "
+                              f"p99 {percentil(latencias, 0.99) * 1e6:7.1f} µs")
+        print(f"{total:>8} checkouts   " + "   ".join(resultados))
+        tamanho *= 10
+
+
+def _baixar(cliente, caminho, cabecalhos):
+    """GET em streaming: tempo até o primeiro pedaço, tempo total e bytes recebidos."""
+    inicio = time.perf_counter()
+    resposta = cliente.get(caminho, headers=cabecalhos, buffered=False)
+    assert resposta.status_code == 200, resposta.status_code
+    partes = iter(resposta.response)
+    tamanho = len(next(partes, b""))
+    primeiro = time.perf_counter() - inicio
+    for parte in partes:
+        tamanho += len(parte)
+    resposta.close()
+    return primeiro, time.perf_counter() - inicio, tamanho
+
+def medir_painel(assinantes, repeticoes=5):
+    """TTFB, tempo total e pico de memória (tracemalloc) do /painel com `assinantes` linhas."""
+    import tracemalloc
+
+    MPbot.salvar_dados(_assinantes(assinantes))
+    cliente = MPbot.app.test_client()
+    cabecalhos = {"Authorization": "Basic " + base64.b64encode(b"admin:benchmark").decode()}
+    ultima = (assinantes + MPbot.PAINEL_POR_PAGINA - 1) // MPbot.PAINEL_POR_PAGINA
+    consultas = {
+        "primeira página": "filtro=todos",
+        "última página": f"filtro=todos&pagina={ultima}",
+        "ativos": "filtro=ativos",
+        "busca por nome": "filtro=todos&busca=Assinante%204242",
+        "busca por id": f"filtro=todos&busca={200000 + assinantes // 2}",
+    }
+    print(f"/painel com {assinantes} assinantes")
+    for nome, consulta in consultas.items():
+        caminho = f"/painel?{consulta}"
+        medicoes = [_baixar(cliente, caminho, cabecalhos) for _ in range(repeticoes)]
+        # A memória é medida à parte: o tracemalloc deixa as alocações bem mais lentas
+        tracemalloc.start()
+        _baixar(cliente, caminho, cabecalhos)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {nome:<16} TTFB p50 {percentil([m[0] for m in medicoes], 0.5) * 1000:7.2f} ms   "
+              f"total p50 {percentil([m[1] for m in medicoes], 0.5) * 1000:7.2f} ms   "
+              f"{medicoes[0][2] / 1024:6.1f} KiB   pico de memória {pico / 1024:8.1f} KiB")
+
+
+def _incrementar(info):
+    info = info or {"nome": "Estresse", "status": "ativo", "contador": 0}
+    info["contador"] += 1
+    return info
+
+def _processo_estresse(operacoes, largada, chegada, resultados, lider_saiu):
+    """Um worker: `operacoes` atualizar() no mesmo assinante e disputa pela liderança."""
+    global MPbot
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MPbot
+    MPbot.abrir_bancos()
+    largada.wait()
+    inicio = time.perf_counter()
+    latencias = _latencias(lambda i: MPbot.armazenamento.atualizar("estresse", _incrementar), operacoes)
+    duracao = time.perf_counter() - inicio
+    lider = MPbot.lideranca.lider()
+    resultados.put((os.getpid(), lider, latencias, duracao))
+    # Ninguém sai antes de todos disputarem; depois o líder sai e os outros disputam de novo
+    largada.wait()
+    if lider:
+        return
+    lider_saiu.wait()
+    resultados.put((os.getpid(), MPbot.lideranca.lider(), None, None))
+    chegada.wait()
+
+def _coletar(resultados, quantidade, filhos):
+    """Lê `quantidade` resultados da fila; se um processo morrer antes, os outros ficariam
+    presos na barreira esperando por ele."""
+    coletados = []
+    while len(coletados) < quantidade:
+        try:
+            coletados.append(resultados.get(timeout=1))
+        except queue.Empty:
+            mortos = [filho.pid for filho in filhos if filho.exitcode not in (None, 0)]
+            if mortos:
+                raise RuntimeError(f"processo(s) {mortos} terminaram com erro")
+    return coletados
+
+def estressar_processos(processos, operacoes):
+    """Vários processos com atualizar() concorrente e eleição do agendador, como os workers do
+    gunicorn. Nenhum incremento pode se perder, e deve haver sempre um líder só."""
+    import multiprocessing
+
+    contexto = multiprocessing.get_context("spawn")
+    largada, chegada = contexto.Barrier(processos), contexto.Barrier(processos - 1)
+    resultados, lider_saiu = contexto.Queue(), contexto.Event()
+    filhos = [
+        contexto.Process(target=_processo_estresse, args=(operacoes, largada, chegada, resultados, lider_saiu))
+        for _ in range(processos)
+    ]
+    for filho in filhos:
+        filho.start()
+    try:
+        primeira = _coletar(resultados, processos, filhos)
+        lideres = {pid for pid, lider, _, _ in primeira if lider}
+        for filho in filhos:
+            if filho.pid in lideres:
+                filho.join()
+        lider_saiu.set()
+        segunda = _coletar(resultados, processos - len(lideres), filhos)
+    except BaseException:
+        for filho in filhos:
+            filho.terminate()
+        raise
+    for filho in filhos:
+        filho.join()
+
+    MPbot.abrir_bancos()
+    contador = (MPbot.armazenamento.obter("estresse") or {}).get("contador", 0)
+    latencias = [latencia for _, _, medidas, _ in primeira for latencia in medidas]
+    novos_lideres = sum(lider for _, lider, _, _ in segunda)
+    ok = contador == processos * operacoes and len(lideres) == 1 and novos_lideres == 1
+    print(f"{processos} processos × {operacoes} atualizar() ({MPbot.DB_BACKEND}): contador {contador} "
+          f"(esperado {processos * operacoes}), p50 {percentil(latencias, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentil(latencias, 0.99) * 1000:.2f} ms, "
+          f"{processos * operacoes / max(d for _, _, _, d in primeira):.0f} op/s no total")
+    print(f"liderança: {len(lideres)} líder(es) entre {processos}; depois da saída do líder, "
+          f"{novos_lideres} entre {processos - len(lideres)}")
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+def _gravar_ate_morrer(modo, gravando):
+    """Processo que regrava o assinantes.json e é morto (SIGKILL) pelo pai no meio da gravação."""
+    global MPbot
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MPbot
+    if modo == "legado":
+        legado = JSONLegado(MPbot.DB_FILE)
+        dados = legado.carregar_dados()
+        dados["200000"]["nome"] = "Gravação nova"
+        gravando.set()
+        legado.salvar_dados(dados)
+    else:
+        MPbot.abrir_bancos()
+        MPbot.armazenamento.obter("200000")  # carrega o cache antes da largada
+        gravando.set()
+        MPbot.armazenamento.atualizar("200000", lambda info: dict(info, nome="Gravação nova"))
+    time.sleep(60)
+
+def testar_queda_gravacao(rodadas, assinantes=20000):
+    """Mata o processo durante a gravação do assinantes.json e confere que o arquivo continua
+    legível, com o conteúdo anterior ou o novo inteiro."""
+    import multiprocessing
+    import signal
+
+    os.environ["DB_BACKEND"] = "json"
+    anterior = _assinantes(assinantes)
+    nova = json.loads(json.dumps(anterior))
+    nova["200000"]["nome"] = "Gravação nova"
+    # Duração de uma gravação completa, para espalhar os SIGKILL ao longo dela
+    inicio = time.perf_counter()
+    with open("medicao.json", "w") as f:
+        json.dump(nova, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    duracao = time.perf_counter() - inicio
+
+    contexto = multiprocessing.get_context("spawn")
+    ok = True
+    for modo in ("legado", "atual"):
+        resultado = {"anterior": 0, "nova": 0, "corrompido": 0}
+        for _ in range(rodadas):
+            with open(MPbot.DB_FILE, "w") as f:
+                json.dump(anterior, f, indent=4)
+            gravando = contexto.Event()
+            filho = contexto.Process(target=_gravar_ate_morrer, args=(modo, gravando))
+            filho.start()
+            if not gravando.wait(60):
+                filho.terminate()
+                raise RuntimeError("o processo de gravação não chegou a gravar")
+            time.sleep(random.uniform(0, duracao * 1.2))
+            os.kill(filho.pid, signal.SIGKILL)
+            filho.join()
+            try:
+                with open(MPbot.DB_FILE) as f:
+                    conteudo = json.load(f)
+            except ValueError:
+                resultado["corrompido"] += 1
+                continue
+            resultado["anterior" if conteudo == anterior else "nova" if conteudo == nova else "corrompido"] += 1
+        temporarios = [nome for nome in os.listdir(".") if nome.endswith(".tmp")]
+        if modo == "atual":
+            # Abrir o armazenamento de novo apaga os temporários dos processos mortos
+            MPbot.ArmazenamentoJSON(MPbot.DB_FILE)
+            restantes = [nome for nome in os.listdir(".") if nome.endswith(".tmp")]
+            ok = resultado["corrompido"] == 0 and not restantes
+        else:
+            restantes = temporarios
+        for nome in restantes:
+            os.remove(nome)
+        print(f"{'JSON antigo' if modo == 'legado' else 'ArmazenamentoJSON':<18} {rodadas} SIGKILL durante a gravação "
+              f"({duracao * 1000:.0f} ms): anterior {resultado['anterior']}, nova {resultado['nova']}, "
+              f"corrompido {resultado['corrompido']}, temporários deixados {len(temporarios)}, "
+              f"após reabrir {len(restantes)}")
+    print("OK" if ok else "FALHOU")
+    return ok
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def medir_inicializacao(repeticoes, servidor):
+    """Import do MPbot e primeiro 200 em `/`, cada medição num processo novo."""
+    ambiente = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    importacao, primeira_resposta = [], []
+    for _ in range(repeticoes):
+        saida = subprocess.run(
+            [sys.executable, "-c", "import time; t = time.perf_counter(); import MPbot; print(time.perf_counter() - t)"],
+            env=ambiente, capture_output=True, text=True, check=True,
+        )
+        importacao.append(float(saida.stdout.split()[-1]))
+
+        porta = _porta_livre()
+        comando = {
+            "gunicorn": ["-m", "gunicorn", "-w", "1", "-b", f"127.0.0.1:{porta}", "MPbot:criar_app()"],
+            "uvicorn": ["-m", "uvicorn", "asgi:app", "--port", str(porta), "--log-level", "warning"],
+        }[servidor]
+        inicio = time.perf_counter()
+        processo = subprocess.Popen([sys.executable] + comando, env=ambiente,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    with urlopen(f"http://127.0.0.1:{porta}/", timeout=1) as resposta:
+                        if resposta.status == 200:
+                            break
+                except OSError:
+                    if processo.poll() is not None:
+                        raise RuntimeError(f"{servidor} terminou antes de responder")
+                    time.sleep(0.005)
+            primeira_resposta.append(time.perf_counter() - inicio)
+        finally:
+            processo.terminate()
+            processo.wait()
+
+    print(f"import MPbot        p50 {percentil(importacao, 0.5) * 1000:8.1f} ms   máx {max(importacao) * 1000:8.1f} ms")
+    print(f"primeiro 200 ({servidor}) p50 {percentil(primeira_resposta, 0.5) * 1000:8.1f} ms   "
+          f"máx {max(primeira_resposta) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requisicoes", type=int, default=500, help="requisições por rota")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--latencia-telegram", type=float, default=0.0, help="segundos por chamada")
+    parser.add_argument("--latencia-mp", type=float, default=0.0, help="segundos por chamada")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de chamadas que falham")
+    parser.add_argument("--assinantes", type=int, default=10000, help="assinantes na simulação de vencimentos")
+    parser.add_argument("--limite-global", type=float, default=1e6,
+                        help="chamadas/s ao Telegram (use 30 para reproduzir o limite real)")
+    parser.add_argument("--limite-chat", type=float, default=1e6,
+                        help="mensagens/s por chat (use 1 para reproduzir o limite real)")
+    parser.add_argument("--backend", choices=["sqlite", "json"], default="sqlite", help="armazenamento de assinantes")
+    parser.add_argument("--sincrono", action="store_true", help="processa os webhooks dentro da requisição")
+    parser.add_argument("--http-local", action="store_true",
+                        help="usa os clientes HTTP de verdade contra um servidor local")
+    parser.add_argument("--clientes-padrao", action="store_true",
+                        help="com --http-local, usa os clientes padrão das bibliotecas")
+    parser.add_argument("--asgi", action="store_true", help="chama as rotas no app ASGI em vez do Flask")
+    parser.add_argument("--inicializacao", type=int, metavar="N", help="mede só o boot, em N processos novos")
+    parser.add_argument("--servidor", choices=["gunicorn", "uvicorn"], default="gunicorn",
+                        help="servidor usado em --inicializacao")
+    parser.add_argument("--armazenamento", type=int, nargs="+", metavar="N",
+                        help="compara por operação o SQLite com as funções JSON antigas, com N assinantes")
+    parser.add_argument("--preferencias", type=int, metavar="N",
+                        help="mede as consultas de checkouts pendentes com até N registros")
+    parser.add_argument("--painel", type=int, metavar="N",
+                        help="mede TTFB e pico de memória do /painel com N assinantes")
+    parser.add_argument("--processos", type=int, metavar="P",
+                        help="P processos com atualizar() concorrente (--requisicoes cada) e eleição de líder")
+    parser.add_argument("--queda-gravacao", type=int, metavar="K",
+                        help="mata o processo K vezes no meio da gravação do assinantes.json")
+    parser.add_argument("--rotas", nargs="*", default=list(CENARIOS), choices=list(CENARIOS))
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="mpbot-benchmark-"))
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:benchmark",
+        "MP_ACCESS_TOKEN": "benchmark",
+        "TELEGRAM_GROUP_ID": "-1000000000000",
+        "WEBHOOK_URL": "http://localhost/notificacao",
+        "ENVIO_LIMITE_GLOBAL": str(args.limite_global),
+        "ENVIO_LIMITE_CHAT": str(args.limite_chat),
+        "PROCESSAMENTO_ASSINCRONO": "0" if args.sincrono else "1",
+        "DB_BACKEND": args.backend,
+        "AGENDADOR": "nenhum",
+        "USUARIO_ADMIN": "admin",
+        "SENHA_ADMIN": "benchmark",
+    })
+    if args.inicializacao:
+        medir_inicializacao(args.inicializacao, args.servidor)
+        return
+
+    global MPbot
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import MPbot
+    if args.armazenamento:
+        medir_armazenamento(args.armazenamento)
+        return
+    if args.preferencias:
+        medir_preferencias(args.preferencias)
+        return
+    if args.queda_gravacao:
+        if not testar_queda_gravacao(args.queda_gravacao):
+            sys.exit(1)
+        return
+    if args.processos:
+        if not estressar_processos(args.processos, args.requisicoes):
+            sys.exit(1)
+        return
+    if args.http_local:
+        stubs = iniciar_stub(args)
+        bot, sdk_mp = clientes_locais(*stubs, args.clientes_padrao)
+        MPbot.configurar_clientes(bot=bot, sdk_mp=sdk_mp)
+    else:
+        MPbot.configurar_clientes(
+            bot=BotFalso(args.latencia_telegram, args.taxa_erro),
+            sdk_mp=SDKFalso(args.latencia_mp, args.taxa_erro),
+        )
+    MPbot.iniciar_servicos()
+    if args.painel:
+        medir_painel(args.painel)
+        return
+
+    print(f"{'ASGI' if args.asgi else 'Flask'}, modo {'síncrono' if args.sincrono else 'assíncrono'} ({args.backend}), "
+          f"{args.requisicoes} requisições por rota, "
+          f"concorrência {args.concorrencia}\n")
+    for nome in args.rotas:
+        medir_rota(nome, args.requisicoes, args.concorrencia, args.asgi)
+    print()
+    medir_cpu_updates(args.requisicoes)
+    print()
+    medir_vencimentos(args.assinantes)
+    if args.http_local:
+        contagem = stubs[0].contagem
+        print()
+        for servico in ("telegram", "mercadopago"):
+            conexoes = contagem.get(("conexoes", servico), 0)
+            requisicoes = contagem.get(("requisicoes", servico), 0)
+            print(f"{servico:<12} {requisicoes:7d} requisições em {conexoes:6d} conexões "
+                  f"({requisicoes / max(conexoes, 1):.1f} por conexão)")
+    else:
+        print(f"\nChamadas ao Telegram: {MPbot.BOT.chamadas}")
+        print(f"Chamadas ao Mercado Pago: {MPbot.sdk.chamadas}")
+
+
+if __name__ == "__main__":
+    main()